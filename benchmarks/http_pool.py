@@ -0,0 +1,73 @@
+"""Benchmark: per-request connection overhead with and without HttpClient pooling
+
+Runs a local stand-in for the image endpoints and fetches the same payload
+with a fresh `requests.get` per call (what the app used to do) and through
+the shared, keep-alive HttpClient.
+
+    python benchmarks/http_pool.py [requests]
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_client import HttpClient  # noqa: E402
+
+PAYLOAD = os.urandom(32 * 1024)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Allow keep-alive
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StandInHandler.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, fetch, url, count):
+    StandInHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        response = fetch(url)
+        assert len(response.content) == len(PAYLOAD)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed / count * 1000:7.2f} ms/request   "
+          f"{StandInHandler.connections:4d} connections for {count} requests")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/prompt/test"
+
+    client = HttpClient()
+    fresh = run("requests.get", lambda u: requests.get(u, timeout=30), url, count)
+    pooled = run("HttpClient (pooled)", client.get, url, count)
+    print(f"\nConnection overhead eliminated: {(fresh - pooled) / count * 1000:.2f} ms/request "
+          f"({fresh / pooled:.1f}x faster). Real endpoints also skip a TLS handshake per request.")
+    print(client.stats_text())
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
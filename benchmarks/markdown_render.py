@@ -0,0 +1,128 @@
+"""Benchmark: MarkdownRenderer against the regex chain it replaced
+
+Renders replies of about 1 KB, 100 KB and 1 MB in one go, then replays each
+as a stream of 200 chunks. The old function had to re-render the whole prefix
+for every chunk; the renderer is fed only the new text.
+
+    python benchmarks/markdown_render.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import MarkdownRenderer  # noqa: E402
+
+SAMPLE = """## Here's the tea
+
+Lowkey this is **super** important, and *kinda* wild. Check `pip install pyqt6` first.
+
+1. Open the [docs](https://example.com/docs?a=1&b=2)
+2. Read the **whole** thing
+3. Profit
+
+* vibes <3
+* more vibes & stuff
+
+```python
+if a < b and c > d:
+    print("no cap")
+```
+
+"""
+
+SIZES = [("1 KB", 1024), ("100 KB", 100 * 1024), ("1 MB", 1024 * 1024)]
+CHUNKS = 200
+
+
+def legacy_markdown_to_html(markdown_text):
+    """The regex-chain renderer MarkdownRenderer replaced, kept verbatim as the baseline"""
+    import re
+
+    # Function to process code blocks
+    def replace_code_block(match):
+        code = match.group(1)
+        # Add syntax highlighting classes if needed
+        return f'<pre style="background-color: #1E1E1E; padding: 10px; border-radius: 5px; color: #D4D4D4; font-family: monospace;">{code}</pre>'
+
+    # Replace code blocks with HTML
+    markdown_text = re.sub(r'```([\s\S]*?)```', replace_code_block, markdown_text)
+
+    # Replace inline code with HTML
+    markdown_text = re.sub(r'`([^`]+)`', r'<code style="background-color: #1E1E1E; padding: 2px 4px; border-radius: 3px; color: #D4D4D4; font-family: monospace;">\1</code>', markdown_text)
+
+    # Replace bold text
+    markdown_text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', markdown_text)
+
+    # Replace italic text
+    markdown_text = re.sub(r'\*(.*?)\*', r'<em>\1</em>', markdown_text)
+
+    # Replace headers (h1, h2, h3)
+    markdown_text = re.sub(r'^# (.*?)$', r'<h1>\1</h1>', markdown_text, flags=re.MULTILINE)
+    markdown_text = re.sub(r'^## (.*?)$', r'<h2>\1</h2>', markdown_text, flags=re.MULTILINE)
+    markdown_text = re.sub(r'^### (.*?)$', r'<h3>\1</h3>', markdown_text, flags=re.MULTILINE)
+
+    # Replace bullet points
+    markdown_text = re.sub(r'^\* (.*?)$', r'<ul><li>\1</li></ul>', markdown_text, flags=re.MULTILINE)
+    # Clean up multiple consecutive ul tags
+    markdown_text = re.sub(r'</ul>\s*<ul>', '', markdown_text)
+
+    # Replace numbered lists
+    markdown_text = re.sub(r'^(\d+)\. (.*?)$', r'<ol start="\1"><li>\2</li></ol>', markdown_text, flags=re.MULTILINE)
+    # Clean up multiple consecutive ol tags
+    markdown_text = re.sub(r'</ol>\s*<ol start="\d+">', '', markdown_text)
+
+    # Replace links
+    markdown_text = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" style="color: #9F6EFF; text-decoration: underline;">\1</a>', markdown_text)
+
+    # Replace paragraphs (two newlines)
+    markdown_text = re.sub(r'\n\s*\n', r'<br><br>', markdown_text)
+
+    # Replace single newlines with <br>
+    markdown_text = re.sub(r'\n', r'<br>', markdown_text)
+
+    return markdown_text
+
+
+def make_input(size):
+    return (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+
+
+def timed(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def stream_legacy(text, step):
+    for end in range(step, len(text) + step, step):
+        legacy_markdown_to_html(text[:end])
+
+
+def stream_renderer(text, step):
+    renderer = MarkdownRenderer()
+    for start in range(0, len(text), step):
+        renderer.feed(text[start:start + step])
+        renderer.html()
+
+
+def main():
+    print(f"{'input':<8} {'legacy':>10} {'renderer':>10}   "
+          f"{'legacy stream':>14} {'renderer stream':>16}   ({CHUNKS} chunks)")
+    for label, size in SIZES:
+        text = make_input(size)
+        step = max(1, len(text) // CHUNKS)
+        repeat = 5 if size < 1024 * 1024 else 1
+        full_legacy = timed(lambda: legacy_markdown_to_html(text), repeat)
+        full_renderer = timed(lambda: MarkdownRenderer.render(text), repeat)
+        stream_old = timed(lambda: stream_legacy(text, step), 1)
+        stream_new = timed(lambda: stream_renderer(text, step), 1)
+        print(f"{label:<8} {full_legacy * 1000:8.1f}ms {full_renderer * 1000:8.1f}ms   "
+              f"{stream_old * 1000:12.1f}ms {stream_new * 1000:14.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
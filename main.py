@@ -1,28 +1,108 @@
 import sys
 import os
+import io
 import shutil
 import json
+import time
+import itertools
+import threading
+import bisect
+import hashlib
+import re
+from html import escape, unescape
+from collections import OrderedDict
 from datetime import datetime
 import google.generativeai as genai
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLineEdit, QPushButton, 
                             QScrollArea, QLabel, QFrame, QDialog,
                             QMessageBox, QFileDialog, QStackedWidget, 
-                            QProgressBar, QSizePolicy, QComboBox, QFileDialog,  QTextEdit, QToolTip)
-from PyQt6.QtCore import Qt, pyqtSignal, QThread, QPropertyAnimation, QEasingCurve, QRect, QSize, QTimer, QPoint, QEvent
-from PyQt6.QtGui import QFont, QIcon, QColor, QPalette, QPixmap, QFontDatabase, QCursor
+                            QProgressBar, QSizePolicy, QComboBox, QFileDialog,  QTextEdit, QToolTip,
+                            QSpinBox, QGridLayout, QCheckBox, QListView, QAbstractItemView,
+                            QStyledItemDelegate)
+from PyQt6.QtCore import (Qt, pyqtSignal, QObject, QRunnable, QThreadPool, QPropertyAnimation, QEasingCurve, QRect, QRectF,
+                          QSize, QTimer, QPoint, QPointF, QEvent, QAbstractListModel, QModelIndex,
+                          QPersistentModelIndex)
+from PyQt6.QtGui import (QFont, QIcon, QColor, QPalette, QPixmap, QImage, QImageReader, QFontDatabase, QCursor,
+                         QPainter, QPainterPath, QLinearGradient, QTextDocument, QAbstractTextDocumentLayout,
+                         QFontMetrics, QTextCursor, QTextDocumentFragment)
 import requests
-from PIL import Image
+from PIL import Image, ImageOps, ExifTags
 import base64
 import random
 import urllib.parse
-import urllib3
+from http_client import HttpClient
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Syntax highlighting is optional; code blocks stay plain without Pygments
+try:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name, guess_lexer
+    from pygments.lexers.special import TextLexer
+    from pygments.util import ClassNotFound
+except ImportError:
+    highlight = None
 
 # Configuration file path
 CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".gemini_chatbot_config.json")
 
+# Downloaded and generated images
+TEMP_DIR = os.path.join(os.path.expanduser("~"), ".genz_chatbot_temp")
+
+# Last chat session, restored on startup when restore_session is on
+SESSION_FILE = os.path.join(os.path.dirname(CONFIG_FILE), ".genz_chatbot_session.json")
+
+# On-disk reply cache, kept next to the config file
+RESPONSE_CACHE_DIR = os.path.join(os.path.dirname(CONFIG_FILE), ".genz_chatbot_cache", "responses")
+
+# Generation settings for chat replies
+GENERATION_CONFIG = {
+    "temperature": 0.9,
+    "max_output_tokens": 1000,
+}
+
+# Default settings, overridable from the config file
+DEFAULT_SETTINGS = {
+    "stream_responses": True,
+    "supersede_pending": True,
+    "context_token_budget": 8000,
+    "system_prompt": "",
+    "response_cache": True,
+    "response_cache_entries": 128,
+    "response_cache_ttl_hours": 168,
+    "image_max_edge": 1600,
+    "image_quality": 85,
+    "upload_mbps": 5,
+    "http_connect_timeout": 5,
+    "http_read_timeout": 60,
+    "http_pool_size": 8,
+    "temp_store_max_mb": 500,
+    "thumbnail_cache_mb": 64,
+    "debug_layout_stats": False,
+    "restore_session": False,
+    "genz_seed": None,
+    "document_cache_mb": 16,
+}
+
+# Maximum number of jobs of each kind that may run at the same time
+JOB_CONCURRENCY = {
+    "chat": 2,
+    "image_understanding": 2,
+    "image_generation": 4,
+    "image_decode": 2,
+    "highlight": 1,
+    "maintenance": 1,
+}
+
+# File extension for each image MIME type we store
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/heic": "heic",
+}
+
 # Custom emoji constants
 EMOJI_LIST = ["✨", "🔥", "💯", "👾", "🚀", "💅", "🤙", "🌈", "😎", "🥶", "👀", "💁‍♀️", "🤌"]
 
@@ -170,81 +250,1068 @@ class ApiKeyDialog(QDialog):
     def get_api_key(self):
         return self.api_key_input.text().strip()
 
-class MessageWorker(QThread):
+class JobSignals(QObject):
+    """Signals for a pooled job, delivered on the GUI thread"""
     response_ready = pyqtSignal(dict)
+    chunk_ready = pyqtSignal(str)
+    progress = pyqtSignal(int, int)  # bytes received, bytes expected (0 if unknown)
     error_occurred = pyqtSignal(str)
+    finished = pyqtSignal()
+
+class JobCancelled(Exception):
+    """Raised inside a job once its handle has been cancelled"""
+
+class CancellationToken:
+    """Thread-safe flag a job polls to find out it should stop"""
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self):
+        self._event.set()
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
     
-    def __init__(self, model, message, chat_history, image_path=None):
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+class JobHandle:
+    """Tracks the lifecycle of a job submitted to the RequestExecutor"""
+    _ids = itertools.count(1)
+    
+    def __init__(self, kind):
+        self.id = next(self._ids)
+        self.kind = kind
+        self.status = "created"  # created -> queued -> running -> done / failed / cancelled
+        self.error = None
+        self.token = CancellationToken()
+        self.submitted_at = None
+        self.started_at = None
+        self.finished_at = None
+    
+    def cancel(self):
+        self.token.cancel()
+    
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+    
+    def is_active(self):
+        return self.status in ("queued", "running")
+    
+    def elapsed(self):
+        """Seconds the job has been running (or ran for)"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+    
+    def __repr__(self):
+        return f"<JobHandle #{self.id} {self.kind} {self.status}>"
+
+class Job(QRunnable):
+    """Base class for work run on the RequestExecutor thread pools"""
+    kind = "chat"
+    
+    def __init__(self, kind=None):
         super().__init__()
+        self.kind = kind or self.kind
+        self.signals = JobSignals()
+        self.handle = JobHandle(self.kind)
+    
+    def run(self):
+        handle = self.handle
+        handle.started_at = time.perf_counter()
+        try:
+            # Jobs cancelled while still queued never start
+            handle.token.raise_if_cancelled()
+            handle.status = "running"
+            self.execute()
+            handle.status = "done"
+        except JobCancelled:
+            handle.status = "cancelled"
+        except Exception as e:
+            if handle.cancelled:
+                # Nobody is waiting for this result any more
+                handle.status = "cancelled"
+            else:
+                handle.status = "failed"
+                handle.error = str(e)
+                self.signals.error_occurred.emit(str(e))
+        finally:
+            handle.finished_at = time.perf_counter()
+            self.signals.finished.emit()
+    
+    def execute(self):
+        raise NotImplementedError
+
+class RequestExecutor(QObject):
+    """Long-lived thread pools, one per job kind, with bounded concurrency"""
+    job_finished = pyqtSignal(object)
+    
+    def __init__(self, limits, parent=None):
+        super().__init__(parent)
+        self.pools = {}
+        for kind, limit in limits.items():
+            pool = QThreadPool(self)
+            pool.setMaxThreadCount(limit)
+            pool.setExpiryTimeout(-1)  # Keep threads warm for the next job
+            self.pools[kind] = pool
+        self.jobs = {}
+    
+    def submit(self, job):
+        """Queue a job on the pool for its kind and return its handle"""
+        handle = job.handle
+        handle.status = "queued"
+        handle.submitted_at = time.perf_counter()
+        
+        # Keep the job alive until it reports back on the GUI thread
+        self.jobs[handle.id] = job
+        job.signals.finished.connect(lambda: self.on_job_finished(handle))
+        
+        self.pools[job.kind].start(job)
+        return handle
+    
+    def on_job_finished(self, handle):
+        self.jobs.pop(handle.id, None)
+        self.job_finished.emit(handle)
+    
+    def active_jobs(self, kind=None):
+        return [job.handle for job in self.jobs.values()
+                if kind is None or job.kind == kind]
+    
+    def cancel_all(self, kind=None):
+        for handle in self.active_jobs(kind):
+            handle.cancel()
+    
+    def shutdown(self, timeout_ms=3000):
+        """Cancel every job and wait for running ones to wind down, at most timeout_ms in all"""
+        self.cancel_all()
+        deadline = time.monotonic() + timeout_ms / 1000
+        for pool in self.pools.values():
+            pool.clear()  # Queued jobs never start
+        for pool in self.pools.values():
+            pool.waitForDone(max(0, int((deadline - time.monotonic()) * 1000)))
+
+def detect_mime_type(header):
+    """Detect an image MIME type from the first bytes of the file"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"heic", b"heix", b"mif1"):
+        return "image/heic"
+    return None
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+class ImageUploadReport:
+    """What pre-processing saved for one uploaded image"""
+    def __init__(self, original_bytes, sent_bytes, upload_mbps):
+        self.original_bytes = original_bytes
+        self.sent_bytes = sent_bytes
+        self.upload_mbps = upload_mbps
+    
+    @property
+    def bytes_saved(self):
+        # Base64 inflates both versions by the same 4/3, so compare raw sizes.
+        # Negative when the sent image is the bigger one
+        return self.original_bytes - self.sent_bytes
+    
+    @property
+    def seconds_saved(self):
+        return self.bytes_saved * 4 / 3 * 8 / (self.upload_mbps * 1_000_000)
+    
+    def summary(self):
+        text = f"🖼️ {format_bytes(self.original_bytes)} → {format_bytes(self.sent_bytes)}"
+        if self.bytes_saved == 0:
+            return text + ", sent as is"
+        change = "less" if self.bytes_saved > 0 else "more"
+        return text + f", ~{abs(self.seconds_saved):.1f}s {change} upload"
+
+class ImagePreprocessor:
+    """Shrinks images before upload: downscale, strip EXIF and re-encode"""
+    def __init__(self, max_edge=1600, quality=85):
+        self.max_edge = max_edge
+        self.quality = quality
+    
+    def process(self, image_bytes, mime_type):
+        """Return (encoded bytes, mime type) for an uploaded image"""
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+        except OSError:
+            # No decoder for it (e.g. HEIC without a plugin): send the file as it is
+            return image_bytes, mime_type
+        if getattr(image, "is_animated", False):
+            # Re-encoding would keep only the first frame
+            return image_bytes, mime_type
+        
+        # Bake the EXIF orientation into the pixels, the tag itself is dropped on save
+        changed = image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+            changed = True
+        
+        output = io.BytesIO()
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if has_alpha:
+            # Keep transparency, JPEG would flatten it
+            image.save(output, "PNG", optimize=True)
+            encoded = (output.getvalue(), "image/png")
+        else:
+            image.convert("RGB").save(output, "JPEG", quality=self.quality, optimize=True, progressive=True)
+            encoded = (output.getvalue(), "image/jpeg")
+        if not changed and len(encoded[0]) >= len(image_bytes):
+            # Re-encoding only made it bigger (e.g. a PNG screenshot of text as JPEG)
+            return image_bytes, mime_type
+        return encoded
+
+class ImagePart:
+    """Reference to an image in a chat turn, resolved to inline data when sent"""
+    __slots__ = ("path", "key")
+    
+    def __init__(self, path):
+        self.path = path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Moved or deleted since it was attached; reading it fails when the turn is sent
+            self.key = (path, None, None)
+            return
+        # Identifies this exact file version for the payload and reply caches
+        self.key = (path, stat.st_mtime_ns, stat.st_size)
+
+class ImagePayloadCache:
+    """Encoded inline-data parts for images, so earlier image turns aren't re-read from disk
+    
+    Parts are pre-processed once and cached by content hash, so the same
+    picture uploaded from two paths is only encoded once.
+    """
+    def __init__(self, preprocessor=None, max_entries=32, upload_mbps=5):
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.max_entries = max_entries
+        self.upload_mbps = upload_mbps
+        self.digests = OrderedDict()  # ImagePart.key -> content hash
+        self.parts = OrderedDict()  # content hash -> inline data part
+        self.lock = threading.Lock()
+    
+    def cached_part(self, digest):
+        with self.lock:
+            part = self.parts.get(digest)
+            if part is not None:
+                self.parts.move_to_end(digest)
+            return part
+    
+    def part_for(self, image, reports=None):
+        with self.lock:
+            digest = self.digests.get(image.key)
+        part = self.cached_part(digest) if digest else None
+        if part is not None:
+            return part
+        
+        with open(image.path, "rb") as f:
+            image_bytes = f.read()
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        with self.lock:
+            self.digests[image.key] = digest
+            self.digests.move_to_end(image.key)
+            while len(self.digests) > self.max_entries:
+                self.digests.popitem(last=False)
+        part = self.cached_part(digest)
+        if part is not None:
+            return part
+        
+        mime_type = detect_mime_type(image_bytes[:16])
+        if mime_type is None:
+            raise ValueError(f"{os.path.basename(image.path)} is not a supported image")
+        data, mime_type = self.preprocessor.process(image_bytes, mime_type)
+        if reports is not None:
+            reports.append(ImageUploadReport(len(image_bytes), len(data), self.upload_mbps))
+        part = {
+            "inline_data": {
+                "mime_type": mime_type,
+                "data": base64.b64encode(data).decode('utf-8')
+            }
+        }
+        
+        with self.lock:
+            self.parts[digest] = part
+            while len(self.parts) > self.max_entries:
+                self.parts.popitem(last=False)
+        return part
+    
+    def resolve(self, contents, reports=None):
+        """Return contents with image references swapped for inline data parts"""
+        resolved = []
+        for content in contents:
+            if any(isinstance(part, ImagePart) for part in content["parts"]):
+                parts = [self.part_for(part, reports) if isinstance(part, ImagePart) else part
+                         for part in content["parts"]]
+                content = {"role": content["role"], "parts": parts}
+            resolved.append(content)
+        return resolved
+
+class ResponseCache:
+    """Exact-match reply cache: a size-bounded in-memory LRU in front of an on-disk store
+    
+    Keys hash the model name, generation config and normalized request contents.
+    Entries older than the TTL are treated as misses and removed.
+    """
+    def __init__(self, directory, max_entries=128, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()  # key -> (created, text)
+        self.lock = threading.Lock()  # Replies are stored from worker threads
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize_text(text):
+        # Indentation and line breaks matter in code, so only the ends and line endings are normalized
+        return text.replace("\r\n", "\n").strip()
+    
+    @classmethod
+    def normalize_part(cls, part):
+        if isinstance(part, str):
+            return cls.normalize_text(part)
+        if isinstance(part, ImagePart):
+            return {"image": list(part.key)}
+        if "text" in part:
+            return cls.normalize_text(part["text"])
+        # Inline data is keyed by its digest, not by the payload itself
+        data = part.get("inline_data", {})
+        digest = hashlib.sha256(data.get("data", "").encode("utf-8")).hexdigest()
+        return {"mime_type": data.get("mime_type"), "sha256": digest}
+    
+    @classmethod
+    def make_key(cls, model_name, generation_config, contents):
+        payload = {
+            "model": model_name,
+            "config": generation_config,
+            "contents": [
+                {"role": content["role"], "parts": [cls.normalize_part(part) for part in content["parts"]]}
+                for content in contents
+            ],
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def get(self, key):
+        """Return the cached reply text or None, counting hits and misses"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.memory[key]
+        
+        # Fall back to the disk tier and promote what we find
+        text = None
+        path = self.path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if now - entry["created"] <= self.ttl_seconds:
+                text = entry["text"]
+                self.remember(key, entry["created"], text)
+            else:
+                os.remove(path)
+        except (OSError, ValueError, KeyError):
+            pass
+        
+        with self.lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+    
+    def put(self, key, text):
+        created = time.time()
+        self.remember(key, created, text)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write atomically so a crash never leaves half an entry behind
+            temp_path = self.path_for(key) + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "text": text}, f)
+            os.replace(temp_path, self.path_for(key))
+        except OSError as e:
+            print(f"Error writing response cache: {str(e)}")
+    
+    def remember(self, key, created, text):
+        with self.lock:
+            self.memory[key] = (created, text)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+    
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.hits = 0
+            self.misses = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def sweep(self):
+        """Delete expired entries and stale partial writes from the disk tier"""
+        removed = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                # Entries are written in one go, so the file time is their creation time
+                age = now - os.path.getmtime(path)
+                if name.endswith(".json") and age > self.ttl_seconds or name.endswith(".tmp") and age > 3600:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+    
+    def stats_text(self):
+        return f"⚡ Cache {self.hits} hits / {self.misses} misses"
+
+class ChatTurn:
+    """One message in the conversation
+    
+    `text` is the raw text exchanged with the model and `html` is only what
+    the bubble displays, so markup never leaks back into the prompt.
+    `markdown` is a reply's post-processed text that `html` was rendered from.
+    """
+    __slots__ = ("role", "text", "html", "markdown", "image", "tokens", "content")
+    
+    def __init__(self, role, text, html=None, image=None, markdown=None):
+        self.role = role  # "user" or "model"
+        self.text = text
+        self.html = html
+        self.markdown = markdown
+        self.image = image
+        self.tokens = 0
+        # Ready-to-send request content, built once per turn
+        parts = [text] if text else []
+        if image:
+            parts.append(ImagePart(image))
+        self.content = {"role": role, "parts": parts}
+
+class Conversation:
+    """Append-only chat history with a ready-to-send request payload"""
+    def __init__(self):
+        self.turns = []
+        self.contents = []
+    
+    def append(self, role, text, html=None, image=None, markdown=None):
+        turn = ChatTurn(role, text, html, image, markdown)
+        self.turns.append(turn)
+        self.contents.append(turn.content)
+        return turn
+    
+    def clear(self):
+        self.turns = []
+        self.contents = []
+    
+    def __len__(self):
+        return len(self.turns)
+    
+    def __iter__(self):
+        return iter(self.turns)
+
+class ContextReport:
+    """Token accounting for one packed request"""
+    def __init__(self, budget, prompt_tokens, sent_messages, dropped_messages):
+        self.budget = budget
+        self.prompt_tokens = prompt_tokens
+        self.sent_messages = sent_messages
+        self.dropped_messages = dropped_messages
+        self.reply_tokens = None
+        self.cached = False
+        self.image_reports = []
+    
+    def summary(self):
+        text = f"Context ~{self.prompt_tokens:,}/{self.budget:,} tokens, {self.sent_messages} msgs"
+        if self.dropped_messages:
+            text += f" ({self.dropped_messages} trimmed)"
+        if self.reply_tokens is not None:
+            text += f" · reply {self.reply_tokens:,} tokens"
+        if self.cached:
+            text += " (cached)"
+        for report in self.image_reports:
+            text += " · " + report.summary()
+        return text
+
+class ContextWindowManager:
+    """Keeps running token estimates for chat history and packs it into a budget
+    
+    Pinned context is always sent first. The newest turns are packed until the
+    budget runs out; anything older is collapsed into a short deterministic note.
+    """
+    CHARS_PER_TOKEN = 4
+    IMAGE_TOKENS = 258  # What Gemini bills for an inline image
+    COLLAPSE_TOPICS = 5
+    COLLAPSE_TOKENS = 120
+    
+    def __init__(self, budget):
+        self.budget = budget
+        self.pinned = []
+        self.tokens = []
+        self.cumulative = [0]  # cumulative[i] == sum(self.tokens[:i])
+    
+    @classmethod
+    def estimate_tokens(cls, text):
+        return max(1, (len(text) + cls.CHARS_PER_TOKEN - 1) // cls.CHARS_PER_TOKEN)
+    
+    def pin(self, text):
+        self.pinned.append(text)
+    
+    def append(self, text, images=0):
+        """Track a new history entry and return its token estimate"""
+        tokens = self.estimate_tokens(text) + images * self.IMAGE_TOKENS
+        self.tokens.append(tokens)
+        self.cumulative.append(self.cumulative[-1] + tokens)
+        return tokens
+    
+    def clear(self):
+        self.tokens = []
+        self.cumulative = [0]
+    
+    def pack(self, conversation):
+        """Return (contents, report) for the newest turns that fit the budget"""
+        turns = conversation.turns
+        preamble = list(self.pinned)
+        pinned_tokens = sum(self.estimate_tokens(text) for text in preamble)
+        available = max(0, self.budget - pinned_tokens)
+        
+        # Leave room for the trimmed-history note when not everything fits
+        total = self.cumulative[-1]
+        collapse_tokens = 0
+        if total > available:
+            collapse_tokens = min(self.COLLAPSE_TOKENS, available // 4)
+            available -= collapse_tokens
+        
+        # First index whose suffix fits, found by bisecting the running totals
+        start = bisect.bisect_left(self.cumulative, total - available)
+        # Always send the newest message, even if it alone is over budget
+        start = min(start, len(turns) - 1) if turns else 0
+        # Requests have to open with a user turn
+        while start < len(turns) - 1 and turns[start].role != "user":
+            start += 1
+        
+        if start:
+            preamble.append(self.collapse(turns, start, collapse_tokens))
+        
+        entries = conversation.contents[start:]
+        prompt_tokens = (pinned_tokens + total - self.cumulative[start]
+                         + sum(self.estimate_tokens(text) for text in preamble[len(self.pinned):]))
+        report = ContextReport(self.budget, prompt_tokens, len(entries), start)
+        
+        # A cancelled or failed reply leaves its user turn unanswered; it goes
+        # out together with the next one instead of as two user turns in a row
+        merged = []
+        for content in entries:
+            if merged and content["role"] == "user" and merged[-1]["role"] == "user":
+                merged[-1] = {"role": "user", "parts": merged[-1]["parts"] + content["parts"]}
+            else:
+                merged.append(content)
+        entries = merged
+        
+        if preamble:
+            # Pinned context and the note about trimmed turns lead the first
+            # user turn, so the request never opens with two user turns in a row
+            if entries and entries[0]["role"] == "user":
+                entries = [{"role": "user", "parts": preamble + entries[0]["parts"]}] + entries[1:]
+            else:
+                entries = [{"role": "user", "parts": preamble}] + entries
+        return entries, report
+    
+    def collapse(self, turns, start, max_tokens):
+        """Summarize the dropped history prefix the same way every time"""
+        note = f"[Earlier conversation trimmed: {start} messages omitted."
+        topics = []
+        index = start - 1
+        while index >= 0 and len(topics) < self.COLLAPSE_TOPICS:
+            turn = turns[index]
+            if turn.role == "user":
+                words = turn.text.split()
+                topic = '"' + " ".join(words[:8]) + ("..." if len(words) > 8 else "") + '"'
+                candidate = note + " Recent topics: " + "; ".join([topic] + topics) + ".]"
+                if self.estimate_tokens(candidate) > max_tokens:
+                    break
+                topics.insert(0, topic)
+            index -= 1
+        if topics:
+            note += " Recent topics: " + "; ".join(topics) + "."
+        return note + "]"
+
+class MessageWorker(Job):
+    def __init__(self, model, contents, image_path=None, stream=False,
+                 context_report=None, cache=None, cache_key=None, image_payloads=None):
+        super().__init__("image_understanding" if image_path else "chat")
         self.model = model
-        self.message = message
-        self.chat_history = chat_history
+        # A slice of the conversation payload, so later sends can't change it mid-request
+        self.contents = contents
+        self.context_report = context_report
+        self.cache = cache
+        self.cache_key = cache_key
+        self.image_payloads = image_payloads or ImagePayloadCache()
         self.image_path = image_path
+        self.stream = stream
         
-    def run(self):
+    def execute(self):
+        self.handle.token.raise_if_cancelled()
+        
+        # Build the multimodal request: the text history plus every image turn in it
+        image_reports = self.context_report.image_reports if self.context_report else None
         try:
-            # Create the prompt by including chat history context
-            history_text = []
-            for msg in self.chat_history:
-                role = "user" if msg["role"] == "user" else "model"
-                
-                # Skip images in history for simplicity
-                history_text.append({"role": role, "parts": [msg["content"]]})
-            
-            # Add the current message with image if provided
-            if self.image_path:
-                try:
-                    # For Gemini, we need to use the specific GenerativeModel.generate_content format
-                    # First, add previous history without the image
-                    
-                    # Then create a new content array with the image
-                    content_parts = []
-                    
-                    # Add text part if there's a message
-                    if self.message:
-                        content_parts.append({"text": self.message})
-                    
-                    # Add image part using the proper format
-                    with open(self.image_path, "rb") as f:
-                        image_bytes = f.read()
-                    
-                    content_parts.append({
-                        "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": base64.b64encode(image_bytes).decode('utf-8')
-                        }
-                    })
-                    
-                    # Make API call with image
-                    response = self.model.generate_content(
-                        content_parts,
-                        generation_config={
-                            "temperature": 0.9,
-                            "max_output_tokens": 1000,
-                        }
-                    )
-                except Exception as e:
-                    self.error_occurred.emit(f"Failed to process image: {str(e)}")
-                    return
+            history_text = self.image_payloads.resolve(self.contents, image_reports)
+        except Exception as e:
+            raise Exception(f"Failed to process image: {str(e)}")
+        
+        response = self.model.generate_content(
+            history_text,
+            generation_config=GENERATION_CONFIG,
+            stream=self.stream
+        )
+        
+        # Forward partial chunks as they arrive when streaming
+        if self.stream:
+            text = self.collect_stream(response)
+        else:
+            text = response.text
+        self.handle.token.raise_if_cancelled()
+        
+        # Process the response
+        response_dict = {
+            "text": text,
+            "images": []  # Will contain URLs if images are generated
+        }
+        if self.context_report:
+            self.context_report.reply_tokens = self.reply_token_count(response, text)
+            response_dict["context"] = self.context_report
+        
+        # Remember the reply for identical requests
+        if self.cache and self.cache_key and text:
+            self.cache.put(self.cache_key, text)
+        
+        self.signals.response_ready.emit(response_dict)
+    
+    def reply_token_count(self, response, text):
+        """Prefer the usage the API reports, fall back to our estimate"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None and getattr(usage, "prompt_token_count", 0):
+            self.context_report.prompt_tokens = usage.prompt_token_count
+            return usage.candidates_token_count
+        return ContextWindowManager.estimate_tokens(text)
+    
+    def collect_stream(self, response):
+        """Emit each streamed chunk and return the full reply text"""
+        parts = []
+        for chunk in response:
+            # Stop reading the stream as soon as the reply is abandoned
+            self.handle.token.raise_if_cancelled()
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. finish or safety metadata)
+                continue
+            if text:
+                parts.append(text)
+                self.signals.chunk_ready.emit(text)
+        return "".join(parts)
+
+class BlobStore:
+    """Content-addressed, size-capped file store for downloaded images
+    
+    Files are named by their SHA-256, so identical images are stored once and
+    names never collide. A persistent index keeps sizes and LRU order; the
+    least recently used unpinned blobs are evicted once the byte cap is hit.
+    """
+    INDEX_FILE = "index.json"
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # digest -> {"ext", "size"}, least recently used first
+        self.total_bytes = 0
+        self.aliases = {}  # lookup key (e.g. a generated image's prompt) -> digest
+        self.alias_names = {}  # digest -> set of keys, to drop aliases on eviction
+        self.pins = {}  # pin owner -> set of digests
+        self.lock = threading.Lock()
+        self.load_index()
+    
+    def load_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        for digest, entry in index.get("blobs", []):
+            self.entries[digest] = entry
+            self.total_bytes += entry["size"]
+        for name, digest in index.get("aliases", {}).items():
+            if digest in self.entries:
+                self.aliases[name] = digest
+                self.alias_names.setdefault(digest, set()).add(name)
+    
+    def save_index(self):
+        """Persist the index; callers hold the lock"""
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            # A list keeps the LRU order across restarts
+            json.dump({"blobs": list(self.entries.items()), "aliases": self.aliases}, f)
+        os.replace(index_path + ".tmp", index_path)
+    
+    def path_for(self, digest):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        return os.path.join(self.directory, f"{digest}.{entry['ext']}")
+    
+    def digest_of(self, path):
+        """Digest for a path inside the store, or None for outside files"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            return None
+        digest = os.path.splitext(os.path.basename(path))[0]
+        return digest if digest in self.entries else None
+    
+    def get(self, digest):
+        """Path of a stored blob, marking it as recently used"""
+        with self.lock:
+            if digest not in self.entries:
+                return None
+            self.entries.move_to_end(digest)
+            return self.path_for(digest)
+    
+    def alias(self, name, digest):
+        """Point a lookup key at a stored blob, replacing what it pointed at before"""
+        with self.lock:
+            old = self.aliases.get(name)
+            if old is not None:
+                self.alias_names.get(old, set()).discard(name)
+            self.aliases[name] = digest
+            self.alias_names.setdefault(digest, set()).add(name)
+            self.save_index()
+    
+    def resolve(self, name):
+        """Path of the blob a lookup key points at, or None"""
+        with self.lock:
+            digest = self.aliases.get(name)
+            if digest is None or digest not in self.entries:
+                return None
+            self.entries.move_to_end(digest)
+            return self.path_for(digest)
+    
+    def forget(self, digest):
+        """Drop a blob and its aliases from the index; callers hold the lock"""
+        self.total_bytes -= self.entries.pop(digest)["size"]
+        for name in self.alias_names.pop(digest, ()):
+            self.aliases.pop(name, None)
+    
+    def temp_path(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{name}.part")
+    
+    def commit(self, temp_path, digest, ext):
+        """Move a finished download into the store under its digest"""
+        with self.lock:
+            if digest in self.entries:
+                # Already stored, the new copy isn't needed
+                os.remove(temp_path)
             else:
-                # Normal text message with history
-                response = self.model.generate_content(
-                    history_text,
-                    generation_config={
-                        "temperature": 0.9,
-                        "max_output_tokens": 1000,
-                    }
-                )
+                size = os.path.getsize(temp_path)
+                self.entries[digest] = {"ext": ext, "size": size}
+                self.total_bytes += size
+                os.replace(temp_path, self.path_for(digest))
+            self.entries.move_to_end(digest)
+            self.evict()
+            self.save_index()
+            return self.path_for(digest)
+    
+    def put_bytes(self, data, ext):
+        digest = hashlib.sha256(data).hexdigest()
+        temp_path = self.temp_path(digest)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self.commit(temp_path, digest, ext)
+    
+    def set_pins(self, owner, paths):
+        """Replace the blobs `owner` keeps alive, e.g. images in the chat history"""
+        digests = {self.digest_of(path) for path in paths if path}
+        digests.discard(None)
+        with self.lock:
+            self.pins[owner] = digests
+    
+    def is_pinned(self, digest):
+        return any(digest in digests for digests in self.pins.values())
+    
+    def evict(self):
+        """Drop least recently used, unpinned blobs until under the cap; callers hold the lock"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for digest in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.is_pinned(digest) or digest == next(reversed(self.entries)):
+                continue
+            path = self.path_for(digest)
+            self.forget(digest)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def sweep(self):
+        """Reconcile the directory with the index and enforce the cap"""
+        known = set()
+        with self.lock:
+            # Forget blobs whose files disappeared
+            for digest in list(self.entries):
+                path = self.path_for(digest)
+                if os.path.exists(path):
+                    known.add(os.path.basename(path))
+                else:
+                    self.forget(digest)
+            self.evict()
+            known.update(os.path.basename(self.path_for(digest)) for digest in self.entries)
+            self.save_index()
+        
+        # Remove untracked files: old timestamp-named images and stale partial downloads
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name in known or name.startswith(self.INDEX_FILE):
+                continue
+            path = os.path.join(self.directory, name)
+            with self.lock:
+                # commit() may have stored this blob since `known` was taken
+                if os.path.splitext(name)[0] in self.entries:
+                    continue
+                try:
+                    if name.endswith(".part") and time.time() - os.path.getmtime(path) < 3600:
+                        continue  # Might still be downloading
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+    
+    def flush(self):
+        with self.lock:
+            self.save_index()
+
+class ImageDecodeJob(Job):
+    """Decodes an image straight to the size it will be shown at"""
+    kind = "image_decode"
+    
+    def __init__(self, path, width, height):
+        super().__init__()
+        self.path = path
+        self.width = width
+        self.height = height
+    
+    def execute(self):
+        reader = QImageReader(self.path)
+        reader.setAutoTransform(True)
+        
+        # Let the reader scale while decoding (JPEG decodes at reduced size)
+        size = reader.size()
+        if size.isValid() and (size.width() > self.width or size.height() > self.height):
+            reader.setScaledSize(size.scaled(self.width, self.height,
+                                             Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            raise Exception(f"Failed to decode image: {reader.errorString()}")
+        self.signals.response_ready.emit({"image": image})
+
+class ImageDecoder(QObject):
+    """Decodes images on the executor and keeps the scaled results in memory"""
+    def __init__(self, executor, max_bytes, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()  # (path, mtime_ns, width, height) -> QImage
+        self.total_bytes = 0
+        self.waiting = {}  # key -> callbacks for a decode in flight
+    
+    def make_key(self, path, width, height):
+        try:
+            return (path, os.stat(path).st_mtime_ns, width, height)
+        except OSError:
+            return None
+    
+    def request(self, path, width, height, callback):
+        """Call callback(QImage) on the GUI thread once `path` is decoded to fit width x height"""
+        key = self.make_key(path, width, height)
+        if key is None:
+            callback(QImage())
+            return
+        
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            callback(image)
+            return
+        
+        # Several widgets can ask for the same image while it's decoding
+        if key in self.waiting:
+            self.waiting[key].append(callback)
+            return
+        self.waiting[key] = [callback]
+        
+        job = ImageDecodeJob(path, width, height)
+        job.signals.response_ready.connect(lambda result: self.on_decoded(key, result["image"]))
+        job.signals.error_occurred.connect(lambda message: self.on_decode_failed(key, message))
+        self.executor.submit(job)
+    
+    def on_decoded(self, key, image):
+        self.images[key] = image
+        self.total_bytes += image.sizeInBytes()
+        while self.total_bytes > self.max_bytes and len(self.images) > 1:
+            _, evicted = self.images.popitem(last=False)
+            self.total_bytes -= evicted.sizeInBytes()
+        
+        for callback in self.waiting.pop(key, []):
+            callback(image)
+    
+    def on_decode_failed(self, key, message):
+        print(message)
+        for callback in self.waiting.pop(key, []):
+            callback(QImage())
+
+class ScaledPixmapCache:
+    """Scaled copies of one source image, keyed by bucketed target size"""
+    BUCKET = 32  # px; nearby sizes during a drag share one scaled copy
+    
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.source = None
+        self.pixmaps = OrderedDict()  # (width, height) -> QPixmap
+    
+    def set_source(self, image):
+        self.source = image
+        self.pixmaps.clear()
+    
+    def get(self, width, height):
+        """Source scaled to fit width x height (rounded down to the bucket), or None"""
+        if self.source is None or self.source.isNull():
+            return None
+        key = (max(self.BUCKET, width - width % self.BUCKET),
+               max(self.BUCKET, height - height % self.BUCKET))
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return pixmap
+        
+        # Always scale from the source so quality never degrades
+        pixmap = QPixmap.fromImage(self.source.scaled(
+            key[0], key[1],
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        ))
+        self.pixmaps[key] = pixmap
+        if len(self.pixmaps) > self.max_entries:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+class StoreSweepJob(Job):
+    """Startup maintenance for an on-disk store, kept off the GUI thread"""
+    kind = "maintenance"
+    
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+    
+    def execute(self):
+        removed = self.store.sweep()
+        self.signals.response_ready.emit({"removed": removed})
+
+class ImageGenerationJob(Job):
+    """Downloads a Pollinations image in chunks, reporting progress as it goes"""
+    kind = "image_generation"
+    CHUNK_SIZE = 64 * 1024
+    
+    def __init__(self, http, prompt, store, seed=None, cache_key=None):
+        super().__init__()
+        self.http = http
+        self.prompt = prompt
+        self.store = store
+        self.seed = seed
+        self.cache_key = cache_key
+    
+    @staticmethod
+    def make_cache_key(prompt, seed):
+        """Lookup key for a generated image: normalized prompt plus generation parameters"""
+        normalized = " ".join(prompt.lower().split())
+        params = json.dumps({"prompt": normalized, "seed": seed, "nologo": seed is not None}, sort_keys=True)
+        return "pollinations:" + hashlib.sha256(params.encode("utf-8")).hexdigest()
+    
+    def execute(self):
+        # Use Pollinations API with direct image generation endpoint
+        url = f"https://image.pollinations.ai/prompt/{urllib.parse.quote(self.prompt)}"
+        if self.seed is not None:
+            # A different seed gives a different variant of the same prompt
+            url += f"?seed={self.seed}&nologo=true"
+        
+        with self.http.get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to generate image: Status {response.status_code}")
             
-            # Process the response
-            response_dict = {
-                "text": response.text,
-                "images": []  # Will contain URLs if images are generated
-            }
+            total = int(response.headers.get("Content-Length") or 0)
+            temp_file = self.store.temp_path(f"download_{os.getpid()}_{self.handle.id}")
             
-            self.response_ready.emit(response_dict)
-        except Exception as e:
-            self.error_occurred.emit(str(e))
+            # Hash while downloading so the file can be stored under its digest
+            digest = hashlib.sha256()
+            header = b""
+            received = 0
+            try:
+                with open(temp_file, 'wb') as f:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        self.handle.token.raise_if_cancelled()
+                        f.write(chunk)
+                        digest.update(chunk)
+                        if len(header) < 16:
+                            header += chunk[:16]
+                        received += len(chunk)
+                        self.signals.progress.emit(received, total)
+            except BaseException:
+                # Don't leave a half-written image behind
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+        
+        ext = IMAGE_EXTENSIONS.get(detect_mime_type(header), "jpg")
+        path = self.store.commit(temp_file, digest.hexdigest(), ext)
+        if self.cache_key:
+            self.store.alias(self.cache_key, digest.hexdigest())
+        self.signals.response_ready.emit({"path": path})
 
 class AnimatedLabel(QLabel):
     def __init__(self, text, parent=None):
@@ -258,261 +1325,1275 @@ class AnimatedLabel(QLabel):
         self.animation.setEasingCurve(QEasingCurve.Type.OutBounce)
         self.animation.start()
 
-class ChatBubble(QFrame):
-    def __init__(self, content, is_user=True, parent=None):
-        super().__init__(parent)
-        self.is_user = is_user
-        
-        # Check if content is a dict (new format) or string (old format)
-        if isinstance(content, dict):
-            self.text = content.get("text", "")
-            self.images = content.get("images", [])
-        else:
-            self.text = content
-            self.images = []
+class ResponsePostProcessor:
+    """Adds Gen Z slang and emojis to a reply while leaving markdown and code untouched"""
+    EXPRESSIONS = [
+        " no cap", " fr", " tbh", " lowkey", " highkey", " bet", " vibes", " bruh",
+        " slay", " iconic", " tho", " ngl", " hit different", " is giving", " sheesh"
+    ]
+    EMOJIS = ["😂", "💯", "👀", "✨", "🔥", "💅", "🙌", "👑", "🤩", "😭", "💀", "🤌", "🤷‍♀️", "🥺", "👉👈"]
+    TECHNICAL_MARKERS = ("```", "def ", "class ", "<html>")
+    STAGES = ("protect", "slang", "emoji", "restore")
+    
+    # Code blocks, inline code, bold and italic, found in one scan
+    PROTECTED = re.compile(r"```[\s\S]*?```|`[^`]*`|\*\*[^*]*\*\*|\*[^*]*\*")
+    PLACEHOLDER = re.compile(r"\x00(\d+)\x00")
+    
+    def __init__(self, seed=None, max_length=500):
+        self.rng = random.Random(seed)
+        self.max_length = max_length  # Longer replies are left alone (None: no limit)
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        self.calls = 0
+    
+    def reseed(self, seed):
+        """Use a fresh RNG; the same seed reproduces the same output"""
+        self.rng = random.Random(seed)
+    
+    def process(self, text):
+        # If the text is highly technical, don't apply GenZ formatting
+        if (self.max_length is not None and len(text) > self.max_length) or \
+                any(marker in text for marker in self.TECHNICAL_MARKERS):
+            return text
+        self.calls += 1
+        timings = self.timings
+        
+        started = time.perf_counter()
+        protected = []
+        text = self.PROTECTED.sub(lambda match: self.protect(protected, match), text)
+        sentences = text.split(". ")
+        timings["protect"] += time.perf_counter() - started
+        
+        started = time.perf_counter()
+        self.add_slang(sentences)
+        timings["slang"] += time.perf_counter() - started
+        
+        started = time.perf_counter()
+        self.add_emojis(sentences)
+        timings["emoji"] += time.perf_counter() - started
+        
+        started = time.perf_counter()
+        text = ". ".join(sentences)
+        if protected:
+            text = self.PLACEHOLDER.sub(lambda match: protected[int(match.group(1))], text)
+        timings["restore"] += time.perf_counter() - started
+        return text
+    
+    @staticmethod
+    def protect(protected, match):
+        protected.append(match.group(0))
+        return f"\x00{len(protected) - 1}\x00"
+    
+    def add_slang(self, sentences):
+        """Give one or two sentences a Gen Z expression (but not too many)"""
+        if len(sentences) <= 3:
+            return
+        count = min(2, len(sentences) // 3)
+        for i in self.rng.sample(range(len(sentences)), count):
+            # Don't modify the last sentence; 70% chance to add an expression
+            if i < len(sentences) - 1 and self.rng.random() < 0.7:
+                sentences[i] += self.rng.choice(self.EXPRESSIONS)
+    
+    def add_emojis(self, sentences):
+        """Add one or two emojis at the end of random sentences"""
+        for _ in range(self.rng.randint(1, 2)):
+            emoji = self.rng.choice(self.EMOJIS)
+            sentences[self.rng.randint(0, len(sentences) - 1)] += f" {emoji}"
+    
+    def stats_text(self):
+        if not self.calls:
+            return "Post-processing: no replies yet"
+        stages = ", ".join(f"{stage} {self.timings[stage] / self.calls * 1000:.3f} ms"
+                           for stage in self.STAGES)
+        return f"Post-processing ({self.calls} replies, avg): {stages}"
+
+class MarkdownRenderer:
+    """Single-pass markdown to HTML for chat bubbles; text can be fed in chunks while it streams"""
+    VERSION = 1  # Bump when the HTML output changes, so cached renders are dropped
+    CODE_BLOCK_STYLE = "background-color: #1E1E1E; padding: 10px; border-radius: 5px; color: #D4D4D4; font-family: monospace;"
+    INLINE_CODE_STYLE = "background-color: #1E1E1E; padding: 2px 4px; border-radius: 3px; color: #D4D4D4; font-family: monospace;"
+    LINK_STYLE = "color: #9F6EFF; text-decoration: underline;"
+    
+    HEADER = re.compile(r"(#{1,6})\s+(.*)")
+    BULLET = re.compile(r"\s*[*-]\s+(.*)")
+    NUMBERED = re.compile(r"\s*(\d+)\.\s+(.*)")
+    # One alternation so each line is scanned once: code, bold, italic, link
+    INLINE = re.compile(r"`([^`]+)`|\*\*(.+?)\*\*|\*([^*\s][^*]*?)\*|\[([^\]]+)\]\(([^)\s]+)\)")
+    # Places where rendered HTML may be cut: list and code block edges, line breaks, headers
+    LINE_CHARS = 80  # What a line break weighs when splitting
+    CODE_CONTINUED = "<!--continued-->"  # Starts a piece that goes on with the code block before it
+    BOUNDARY = re.compile(r"<(/?)(ul|ol|pre|span)\b[^>]*>|<br>|</h[1-6]>|\n")
+    
+    def __init__(self, highlighted=None):
+        self.highlighted = highlighted  # (language, code) -> highlighted HTML or None
+        self.unhighlighted = []  # (language, code) of finished blocks rendered plain
+        self.parts = []
+        self.block = None  # "ul", "ol" or "code" while one is open
+        self.last = None   # "text" or "block": what the previous line produced
+        self.blank = False  # Blank lines seen since the last rendered line
+        self.tail = ""     # Unfinished last line, waiting for its newline
+        self.code_lines = 0  # Lines in the open code block
+        self.code_language = ""
+        self.code_start = 0  # Index in parts where the open code block starts
+        self.code = []
+    
+    @classmethod
+    def render(cls, text, highlighted=None):
+        renderer = cls(highlighted)
+        renderer.feed(text)
+        renderer.finish()
+        return renderer.html()
+    
+    @classmethod
+    def split(cls, html, size):
+        """Cut rendered HTML into pieces of at least `size` characters at block boundaries
+        
+        Line breaks count as a full line of text, so short code lines make short pieces.
+        Each piece is complete HTML. One cut at a line break starts the next piece
+        with that <br>, so it continues the paragraph; any other piece starts a new
+        block. Code blocks are cut between lines where no highlighting span is open,
+        and reopened with CODE_CONTINUED and the same <pre> tag. Lists are never cut.
+        """
+        pieces = []
+        start = 0
+        prefix = ""  # <pre> tag the next piece reopens
+        depth = 0    # Open lists
+        spans = 0    # Open highlighting spans in the code block
+        pre = None   # Opening tag of the code block we are in
+        lines = 0    # Line breaks since the start of the piece
+        for match in cls.BOUNDARY.finditer(html):
+            tag = match.group(0)
+            closing, name = match.group(1), match.group(2)
+            if name == "span":
+                spans += -1 if closing else 1
+                continue
+            lines += 1
+            resume = match.end()
+            if name == "pre":
+                pre = None if closing else tag
+                spans = 0
+                if pre is not None:
+                    continue
+                end = match.end()
+            elif name:
+                depth += -1 if closing else 1
+                if not closing or depth:
+                    continue
+                end = match.end()
+            elif tag == "\n":
+                if pre is None or spans:
+                    continue
+                end = match.start()
+            elif depth or pre is not None:
+                continue
+            elif tag == "<br>":
+                # Cut before the first <br> of a run; the next piece carries them
+                if html.endswith("<br>", 0, match.start()):
+                    continue
+                end = resume = match.start()
+            else:
+                end = match.end()
             
-        self.init_ui()
+            if end - start + lines * cls.LINE_CHARS < size or resume >= len(html) or html.startswith(("<ul", "<ol"), resume):
+                continue
+            piece = prefix + html[start:end]
+            if pre is not None:
+                piece += "</pre>"
+            pieces.append(piece)
+            prefix = cls.CODE_CONTINUED + pre if pre is not None else ""
+            start = resume
+            lines = 0
+        pieces.append(prefix + html[start:])
+        return pieces
+    
+    def feed(self, chunk):
+        """Render the lines `chunk` completes; earlier output is never revisited"""
+        lines = (self.tail + chunk).split("\n")
+        self.tail = lines.pop()
+        for line in lines:
+            self.render_line(line.rstrip("\r"))
+    
+    def finish(self):
+        """Complete the last line and any open code block; no more text will come"""
+        if self.tail:
+            self.feed("\n")
+        if self.block == "code":
+            self.close_code_block()
+    
+    def html(self):
+        """HTML for everything fed so far, with open blocks closed
         
-    def init_ui(self):
-        # Import Qt at the beginning of the method to ensure it's available
-        from PyQt6.QtCore import Qt
+        Lines are parsed once, but the output is joined in full on every call.
+        """
+        # Render the unfinished line provisionally, then roll the state back
+        state = (self.block, self.last, self.blank, self.code_lines, self.code_language, self.code_start)
+        lengths = (len(self.parts), len(self.code), len(self.unhighlighted))
+        code = self.code
+        if self.tail:
+            self.render_line(self.tail)
+        self.close_block()
+        html = "".join(self.parts)
+        
+        del self.parts[lengths[0]:]
+        self.code = code
+        del self.code[lengths[1]:]
+        del self.unhighlighted[lengths[2]:]
+        self.block, self.last, self.blank, self.code_lines, self.code_language, self.code_start = state
+        return html
+    
+    def close_block(self):
+        if self.block == "code":
+            self.parts.append("</pre>")
+        elif self.block:
+            self.parts.append(f"</{self.block}>")
+        if self.block:
+            self.last = "block"
+        self.block = None
+    
+    def close_code_block(self):
+        code = "\n".join(self.code)
+        html = self.highlighted(self.code_language, code) if self.highlighted else None
+        if html is None:
+            self.unhighlighted.append((self.code_language, code))
+            self.close_block()
+            return
+        # Swap the plain lines for the highlighted version
+        del self.parts[self.code_start:]
+        self.parts.append(f'<pre style="{self.CODE_BLOCK_STYLE}">{html}</pre>')
+        self.block = None
+        self.last = "block"
+    
+    def render_line(self, line):
+        parts = self.parts
+        if self.block == "code":
+            if line.lstrip().startswith("```"):
+                self.close_code_block()
+            else:
+                self.code.append(line)
+                parts.append(("\n" if self.code_lines else "") + escape(line, quote=False))
+                self.code_lines += 1
+            return
         
-        # Reset any existing layout and margins
-        self.setContentsMargins(0, 0, 0, 0)
+        stripped = line.lstrip()
+        if stripped.startswith("```"):
+            self.close_block()
+            body = stripped[3:]
+            if "```" in body:
+                # Fence opened and closed on one line
+                parts.append(f'<pre style="{self.CODE_BLOCK_STYLE}">{escape(body[:body.index("```")], quote=False)}</pre>')
+                self.last = "block"
+            else:
+                self.code_start = len(parts)
+                parts.append(f'<pre style="{self.CODE_BLOCK_STYLE}">')
+                self.block = "code"
+                self.code_lines = 0
+                self.code_language = body.strip()
+                self.code = []
+            self.blank = False
+            return
         
-        # Create main layout with proper spacing
-        main_layout = QHBoxLayout(self)
-        main_layout.setContentsMargins(0, 10, 0, 10)  # Increased vertical padding
-        main_layout.setSpacing(0)
+        if not stripped:
+            # Blank lines separate paragraphs but don't end a list
+            self.blank = True
+            return
         
-        # Create bubble container
-        bubble_container = QWidget()
-        bubble_layout = QVBoxLayout(bubble_container)
-        bubble_layout.setSpacing(6)  # Slightly increased spacing
-        
-        # Message content
-        message_container = QWidget()
-        message_layout = QVBoxLayout(message_container)
-        message_layout.setContentsMargins(18, 16, 18, 16)  # Increased padding
-        
-        # For bot messages, use QTextEdit instead of QLabel to enable better text selection
-        if not self.is_user:
-            self.message = QTextEdit()
-            self.message.setReadOnly(True)
-            self.message.setHtml(self.text)
-            self.message.setStyleSheet("""
-                color: white; 
-                font-size: 15px;  /* Increased font size */
-                line-height: 145%;  /* Added line spacing */
-                background: transparent;
-                border: none;
-                padding: 2px;
-            """)
-            
-            # Make the text edit automatically resize to fit content
-            self.message.document().documentLayout().documentSizeChanged.connect(
-                lambda: self.adjust_text_size()
-            )
-            
-            # Set text edit to automatically expand
-            self.message.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-            self.message.setSizePolicy(
-                QSizePolicy.Policy.Expanding,
-                QSizePolicy.Policy.Expanding
-            )
-            
-            # Create copy button for bot messages
-            copy_button = QPushButton("Copy")
-            copy_button.setStyleSheet("""
-                background-color: #5D4E9E;
-                color: white;
-                border-radius: 8px;
-                padding: 6px 12px;  /* Larger padding */
-                font-size: 12px;
-                margin-top: 8px;
-                font-weight: 500;
-            """)
-            copy_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
-            copy_button.clicked.connect(lambda: self.copy_text_to_clipboard())
-            
-            # Add copy button to message layout
-            button_container = QWidget()
-            button_layout = QHBoxLayout(button_container)
-            button_layout.setContentsMargins(0, 0, 0, 0)
-            button_layout.addStretch()
-            button_layout.addWidget(copy_button)
-            
-            message_layout.addWidget(self.message)
-            message_layout.addWidget(button_container)
+        match = self.BULLET.match(line)
+        if match:
+            if self.block != "ul":
+                self.close_block()
+                parts.append("<ul>")
+                self.block = "ul"
+            parts.append(f"<li>{self.inline(match.group(1))}</li>")
+            self.blank = False
+            return
+        
+        match = self.NUMBERED.match(line)
+        if match:
+            if self.block != "ol":
+                self.close_block()
+                parts.append(f'<ol start="{match.group(1)}">')
+                self.block = "ol"
+            parts.append(f"<li>{self.inline(match.group(2))}</li>")
+            self.blank = False
+            return
+        
+        self.close_block()
+        match = self.HEADER.match(line)
+        if match:
+            level = len(match.group(1))
+            parts.append(f"<h{level}>{self.inline(match.group(2))}</h{level}>")
+            self.last = "block"
         else:
-            # User message still uses QLabel but with improved styling
-            self.message = QLabel(self.text)
-            self.message.setWordWrap(True)
-            
-            self.message.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-            self.message.setStyleSheet("""
-                color: white; 
-                font-size: 15px;  /* Increased font size */
-                line-height: 145%;  /* Added line spacing */
-                background: transparent;
-                padding: 2px;
-            """)
-            
-            message_layout.addWidget(self.message)
-        
-        # Add images if any (commented out in original code)
-        # Image handling code would go here
-        
-        # Time stamp with emoji for Gen Z flair
-        random_emoji = random.choice(EMOJI_LIST)
-        time_str = datetime.now().strftime("%H:%M")
-        time_label = QLabel(f"{time_str} {random_emoji}")
-        time_label.setStyleSheet("color: rgba(255, 255, 255, 0.7); font-size: 12px;")
-        
-        # Apply styles based on sender
-        if self.is_user:
-            # User message styling with improved gradient
-            gradient = "qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 #A575FF, stop:1 #9F6EFF)"
-            message_container.setStyleSheet(f"""
-                background: {gradient};
-                border-radius: 20px 8px 20px 20px;  /* Increased border-radius */
-                color: white;
-            """)
-            
-            # Add time label to right side of bubble
-            time_container = QWidget()
-            time_layout = QHBoxLayout(time_container)
-            time_layout.setContentsMargins(4, 0, 10, 0)  # Increased right margin
-            time_layout.addStretch()
-            time_layout.addWidget(time_label)
-            
-            bubble_layout.addWidget(message_container)
-            bubble_layout.addWidget(time_container)
-            
-            # Right-align the bubble
-            main_layout.addStretch(1)
-            main_layout.addWidget(bubble_container)
-            main_layout.addSpacing(20)  # Increased right margin
+            if self.last == "text":
+                parts.append("<br><br>" if self.blank else "<br>")
+            parts.append(self.inline(line))
+            self.last = "text"
+        self.blank = False
+    
+    def inline(self, text):
+        out = []
+        position = 0
+        for match in self.INLINE.finditer(text):
+            out.append(escape(text[position:match.start()], quote=False))
+            code, bold, italic, label, url = match.groups()
+            if code is not None:
+                out.append(f'<code style="{self.INLINE_CODE_STYLE}">{escape(code, quote=False)}</code>')
+            elif bold is not None:
+                out.append(f"<strong>{self.inline(bold)}</strong>")
+            elif italic is not None:
+                out.append(f"<em>{self.inline(italic)}</em>")
+            else:
+                out.append(f'<a href="{escape(url, quote=True)}" style="{self.LINK_STYLE}">{self.inline(label)}</a>')
+            position = match.end()
+        out.append(escape(text[position:], quote=False))
+        return "".join(out)
+
+class HighlightJob(Job):
+    """Highlights one code block off the GUI thread"""
+    kind = "highlight"
+    
+    def __init__(self, highlighter, language, code):
+        super().__init__()
+        self.highlighter = highlighter
+        self.language = language
+        self.code = code
+    
+    def execute(self):
+        html = self.highlighter.highlight(self.language, self.code)
+        self.signals.response_ready.emit({"html": html})
+
+class CodeHighlighter(QObject):
+    """Pygments highlighting on the executor; lexers cached per language, results per (language, code)"""
+    STYLE = "monokai"
+    
+    def __init__(self, executor, max_entries=256, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.max_entries = max_entries
+        self.available = highlight is not None
+        self.results = OrderedDict()  # (language, code hash) -> HTML
+        self.waiting = {}  # key -> callbacks for a job in flight
+        self.lexers = {}
+        self.lock = threading.Lock()
+        self.formatter = HtmlFormatter(nowrap=True, noclasses=True, style=self.STYLE) if self.available else None
+    
+    @staticmethod
+    def make_key(language, code):
+        return (language.lower(), hashlib.sha1(code.encode("utf-8")).hexdigest())
+    
+    def cached(self, language, code):
+        """Highlighted HTML if it's ready, else None"""
+        key = self.make_key(language, code)
+        html = self.results.get(key)
+        if html is not None:
+            self.results.move_to_end(key)
+        return html
+    
+    def request(self, language, code, callback):
+        """Call callback(html) on the GUI thread once the block is highlighted"""
+        if not self.available:
+            return
+        key = self.make_key(language, code)
+        if key in self.results:
+            callback(self.results[key])
+            return
+        if key in self.waiting:
+            self.waiting[key].append(callback)
+            return
+        self.waiting[key] = [callback]
+        
+        job = HighlightJob(self, language, code)
+        job.signals.response_ready.connect(lambda result: self.on_highlighted(key, result["html"]))
+        job.signals.error_occurred.connect(lambda message: self.on_failed(key, message))
+        self.executor.submit(job)
+    
+    def on_highlighted(self, key, html):
+        self.results[key] = html
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+        for callback in self.waiting.pop(key, []):
+            callback(html)
+    
+    def on_failed(self, key, message):
+        print(f"Highlighting failed: {message}")
+        self.waiting.pop(key, None)
+    
+    def lexer_for(self, language, code):
+        if not language:
+            # Untagged blocks need a guess, which depends on the code itself
+            try:
+                return guess_lexer(code)
+            except ClassNotFound:
+                return TextLexer()
+        with self.lock:
+            lexer = self.lexers.get(language.lower())
+        if lexer is None:
+            try:
+                lexer = get_lexer_by_name(language.lower())
+            except ClassNotFound:
+                lexer = TextLexer()
+            with self.lock:
+                self.lexers[language.lower()] = lexer
+        return lexer
+    
+    def highlight(self, language, code):
+        """Highlighted HTML for a code block; runs on a worker thread"""
+        html = highlight(code, self.lexer_for(language, code), self.formatter)
+        return html[:-1] if html.endswith("\n") else html
+
+class RenderedReply:
+    """A bot reply as shown: post-processed markdown, its HTML and measured text heights"""
+    __slots__ = ("key", "markdown", "html", "pending", "heights")
+    MAX_WIDTHS = 8
+    
+    def __init__(self, key, markdown, html, pending):
+        self.key = key  # RenderCache key
+        self.markdown = markdown
+        self.html = html
+        self.pending = pending  # (language, code) blocks still waiting for highlighting
+        self.heights = {}  # text width -> document height
+    
+    def copy(self):
+        """A copy for one row, as highlighting updates it in place
+        
+        `heights` is shared, not copied: it belongs to one `html`, and a new
+        `html` always comes with a new dict. So heights the delegate measures
+        for a row also reach the cached entry and every row showing that HTML.
+        """
+        rendered = RenderedReply(self.key, self.markdown, self.html, list(self.pending))
+        rendered.heights = self.heights
+        return rendered
+
+class RenderCache:
+    """Rendered replies keyed by (raw text hash, renderer version)
+    
+    Entries are copied in and out, so highlighting one row never changes
+    another; only their measured heights are shared.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(raw_text):
+        return (hashlib.sha1(raw_text.encode("utf-8")).hexdigest(), MarkdownRenderer.VERSION)
+    
+    def get(self, key):
+        rendered = self.entries.get(key)
+        if rendered is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return rendered.copy()
+    
+    def put(self, key, rendered):
+        self.entries[key] = rendered.copy()
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return rendered
+    
+    def stats_text(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0
+        return f"render cache {self.hits}/{lookups} hits ({rate:.0f}%)"
+
+class TranscriptRow:
+    """One entry of the chat transcript: a message, a system note or a loading placeholder"""
+    __slots__ = ("kind", "text", "timestamp", "layout", "copied", "measured", "source", "pieces", "shown", "expanded",
+                 "on_shown")
+    
+    def __init__(self, kind, text):
+        self.kind = kind  # "user", "bot", "system" or "loading"
+        self.text = text  # Plain text, except bot replies which are HTML
+        self.timestamp = None
+        if kind in ("user", "bot"):
+            # Time stamp with emoji for Gen Z flair
+            self.timestamp = f"{datetime.now().strftime('%H:%M')} {random.choice(EMOJI_LIST)}"
+        self.layout = None  # (view width, size hint, bubble rect, estimated), computed by the delegate
+        self.copied = False
+        self.measured = None  # Text heights of the row's RenderedReply, for bot replies
+        self.source = None  # Markdown a finished bot reply was rendered from
+        self.pieces = None  # (text, HTML pieces) of a long bot reply, split by the delegate
+        self.shown = 1  # Pieces laid out so far
+        self.expanded = False
+        self.on_shown = None  # Run once when the row first comes within a screen of the viewport
+
+class TranscriptModel(QAbstractListModel):
+    """The chat transcript as a flat list of rows"""
+    RowRole = Qt.ItemDataRole.UserRole
+    
+    def __init__(self, scheduler, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.rows = []
+        self.loading_rows = 0
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == self.RowRole:
+            return row
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row.text
+        return None
+    
+    def append(self, kind, text):
+        position = len(self.rows)
+        row = TranscriptRow(kind, text)
+        self.beginInsertRows(QModelIndex(), position, position)
+        self.rows.append(row)
+        if kind == "loading":
+            self.loading_rows += 1
+        self.endInsertRows()
+        return row
+    
+    def extend(self, entries):
+        """Append (kind, text) entries with a single insert notification"""
+        if not entries:
+            return []
+        position = len(self.rows)
+        rows = [TranscriptRow(kind, text) for kind, text in entries]
+        self.beginInsertRows(QModelIndex(), position, position + len(rows) - 1)
+        self.rows.extend(rows)
+        self.loading_rows += sum(1 for row in rows if row.kind == "loading")
+        self.endInsertRows()
+        return rows
+    
+    def index_of(self, row):
+        # Rows that change are almost always near the end
+        for position in range(len(self.rows) - 1, -1, -1):
+            if self.rows[position] is row:
+                return self.index(position)
+        return QModelIndex()
+    
+    def set_text(self, row, text, measured=None):
+        """Replace a row's text; it is measured again with the next frame"""
+        row.text = text
+        row.measured = measured
+        self.scheduler.schedule(row, lambda: self.invalidate(row))
+    
+    def invalidate(self, row):
+        row.layout = None
+        self.refresh(row)
+    
+    def refresh(self, row):
+        """Repaint a row whose text hasn't changed"""
+        index = self.index_of(row)
+        if index.isValid():
+            self.dataChanged.emit(index, index)
+    
+    def remove(self, row):
+        index = self.index_of(row)
+        if not index.isValid():
+            return
+        self.beginRemoveRows(QModelIndex(), index.row(), index.row())
+        del self.rows[index.row()]
+        if row.kind == "loading":
+            self.loading_rows -= 1
+        self.endRemoveRows()
+    
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.loading_rows = 0
+        self.endResetModel()
+
+def bubble_path(rect, top_left, top_right, bottom_right, bottom_left):
+    """Rounded rectangle with a separate radius per corner"""
+    path = QPainterPath()
+    x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+    path.moveTo(x + top_left, y)
+    path.lineTo(x + w - top_right, y)
+    path.arcTo(x + w - 2 * top_right, y, 2 * top_right, 2 * top_right, 90, -90)
+    path.lineTo(x + w, y + h - bottom_right)
+    path.arcTo(x + w - 2 * bottom_right, y + h - 2 * bottom_right, 2 * bottom_right, 2 * bottom_right, 0, -90)
+    path.lineTo(x + bottom_left, y + h)
+    path.arcTo(x, y + h - 2 * bottom_left, 2 * bottom_left, 2 * bottom_left, 270, -90)
+    path.lineTo(x, y + top_left)
+    path.arcTo(x, y, 2 * top_left, 2 * top_left, 180, -90)
+    path.closeSubpath()
+    return path
+
+class ChatBubbleDelegate(QStyledItemDelegate):
+    """Paints transcript rows as chat bubbles, so no widgets are built per message"""
+    MARGIN = 20          # Space between a bubble and the side of the view
+    ROW_SPACING = 15     # Half the gap between two rows
+    BUBBLE_SPACING = 10  # Extra space above and below message bubbles
+    PADDING_X = 18
+    PADDING_Y = 16
+    MAX_WIDTH = 0.85     # Share of the view width a bubble may use
+    TIME_HEIGHT = 22
+    COPY_WIDTH = 64
+    COPY_HEIGHT = 28
+    LOADING_HEIGHT = 50
+    EXPAND_WIDTH = 96
+    COLLAPSE_CHARS = 6000  # Longer replies show their first piece and a "Show more" button
+    PIECE_CHARS = 3000  # About a screenful of text
+    DOCUMENT_BYTES_PER_CHAR = 40  # Rough footprint of a laid-out document per character of source
+    TAG = re.compile(r"<[^>]+>")
+    LINE_BREAK = re.compile(r"<br>|</(?:li|h[1-6]|pre)>")
+    
+    copy_requested = pyqtSignal(object)  # TranscriptRow
+    expand_requested = pyqtSignal(object)  # TranscriptRow
+    
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.text_font = QFont(QApplication.font())
+        self.text_font.setPixelSize(15)
+        self.small_font = QFont(QApplication.font())
+        self.small_font.setPixelSize(12)
+        self.system_font = QFont(QApplication.font())
+        self.system_font.setItalic(True)
+        self.documents = OrderedDict()  # row -> (text, text width, laid-out QTextDocument, bytes)
+        self.document_bytes = 0
+        self.max_document_bytes = DEFAULT_SETTINGS["document_cache_mb"] * 1024 * 1024
+        self.editing_row = None  # Row currently covered by the hover editor
+        
+        # Used to guess text heights without building documents
+        metrics = QFontMetrics(self.text_font)
+        self.line_height = metrics.lineSpacing()
+        sample = "The quick brown fox jumps over the lazy dog. 0123456789"
+        self.char_width = max(1, round(metrics.horizontalAdvance(sample) / len(sample)))
+    
+    def make_document(self, row, text_width):
+        document = QTextDocument()
+        document.setDefaultFont(self.text_font)
+        document.setDocumentMargin(2)
+        if row.kind == "bot":
+            pieces = self.pieces_for(row)
+            document.setHtml(pieces[0])
+            for piece in pieces[1:row.shown]:
+                self.append_piece(document, piece)
         else:
-            # Bot message styling with improved gradient
-            gradient = "qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 #363636, stop:1 #2D2D30)"
-            message_container.setStyleSheet(f"""
-                background: {gradient};
-                border-radius: 8px 20px 20px 20px;  /* Increased border-radius */
-                color: white;
-            """)
-            
-            # Add time label to left side of bubble
-            time_container = QWidget()
-            time_layout = QHBoxLayout(time_container)
-            time_layout.setContentsMargins(10, 0, 4, 0)  # Increased left margin
-            time_layout.addWidget(time_label)
-            time_layout.addStretch()
+            document.setPlainText(row.text)
+        document.setTextWidth(text_width)
+        return document
+    
+    def document_for(self, row, text_width):
+        """Laid-out document of a message row, reused until its text or width changes"""
+        entry = self.documents.get(row)
+        if entry is not None and entry[0] is row.text and entry[1] == text_width and entry[2] == row.shown:
+            self.documents.move_to_end(row)
+            return entry[3]
+        
+        document = self.make_document(row, text_width)
+        self.store_document(row, text_width, document)
+        return document
+    
+    def store_document(self, row, text_width, document):
+        """Keep a document under the memory budget; the least recently painted go first"""
+        previous = self.documents.pop(row, None)
+        if previous is not None:
+            self.document_bytes -= previous[4]
+        cost = sum(map(len, self.pieces_for(row)[:row.shown])) * self.DOCUMENT_BYTES_PER_CHAR
+        self.documents[row] = (row.text, text_width, row.shown, document, cost)
+        self.document_bytes += cost
+        self.evict_documents()
+    
+    def evict_documents(self):
+        while self.document_bytes > self.max_document_bytes and len(self.documents) > 1:
+            _, evicted = self.documents.popitem(last=False)
+            self.document_bytes -= evicted[4]
+    
+    def pieces_for(self, row):
+        """The parts of a message that can be laid out one at a time; one part unless it is a long reply"""
+        if row.pieces is not None and row.pieces[0] is row.text:
+            return row.pieces[1]
+        if row.kind == "bot" and len(row.text) > self.COLLAPSE_CHARS:
+            pieces = MarkdownRenderer.split(row.text, self.PIECE_CHARS)
+        else:
+            pieces = [row.text]
+        row.pieces = (row.text, pieces)
+        row.shown = min(row.shown, len(pieces))
+        return pieces
+    
+    def show_next_piece(self, row):
+        """Lay out one more piece of a long reply, appending to its document if it is cached"""
+        pieces = self.pieces_for(row)
+        if row.shown >= len(pieces):
+            return False
+        entry = self.documents.get(row)
+        row.shown += 1
+        if entry is None or entry[0] is not row.text or entry[2] != row.shown - 1:
+            return True  # Built with all shown pieces when next painted
+        self.append_piece(entry[3], pieces[row.shown - 1])
+        self.store_document(row, entry[1], entry[3])
+        return True
+    
+    def append_piece(self, document, html):
+        """Add a piece at the end; only its text is laid out, the blocks above keep their layout"""
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        if html.startswith("<br>"):
+            # Goes on with the paragraph at the cursor
+            fragment = QTextDocumentFragment.fromHtml(html)
+        else:
+            # The fragment's first block is merged into the one at the cursor, so give
+            # it a fresh block with that block's own format
+            piece = QTextDocument()
+            piece.setHtml(html)
+            block_format = piece.begin().blockFormat()
+            if html.startswith(MarkdownRenderer.CODE_CONTINUED):
+                # No margins where a code block was cut
+                last_format = cursor.blockFormat()
+                last_format.setBottomMargin(0)
+                cursor.setBlockFormat(last_format)
+                block_format.setTopMargin(0)
+            cursor.insertBlock(block_format, piece.begin().charFormat())
+            fragment = QTextDocumentFragment(piece)
+        cursor.insertFragment(fragment)
+    
+    def clear_documents(self):
+        self.documents.clear()
+        self.document_bytes = 0
+    
+    def estimate_text_size(self, row, text_width):
+        """(width, height) the text will roughly take, without building a document"""
+        text = row.text
+        if row.kind == "bot":
+            text = "".join(self.pieces_for(row)[:row.shown])
+        breaks = text.count("\n")
+        if row.kind == "bot":
+            breaks += text.count("<br>") + text.count("<li>") + 2 * text.count("<h")
+            text = self.TAG.sub("", text)
+        chars_per_line = max(1, text_width // self.char_width)
+        lines = breaks + 1 + len(text) // chars_per_line
+        width = text_width
+        if row.kind == "user" and lines == 1:
+            width = min(text_width, len(text) * self.char_width + 4)
+        return width, lines * self.line_height + 4
+    
+    def row_layout(self, row, width, exact=True):
+        """(size hint, bubble rect) of a row at the given view width, cached on the row
+        
+        With exact=False, messages that were never measured get an estimated height
+        so rows far from the viewport don't need a document at all.
+        """
+        layout = row.layout
+        if layout is not None and layout[0] == width and not (exact and layout[3]):
+            return layout[1], layout[2]
+        
+        bubble = QRect()
+        estimated = False
+        if row.kind in ("user", "bot"):
+            max_text_width = max(60, int((width - 2 * self.MARGIN) * self.MAX_WIDTH) - 2 * self.PADDING_X)
+            text_width = max_text_width
+            measured = row.measured
+            pieces = self.pieces_for(row)
+            key = max_text_width if row.shown == len(pieces) else (max_text_width, row.shown)
+            if measured is not None and key in measured:
+                # Measured before, e.g. the same reply shown again: no document needed
+                text_height = measured[key]
+            elif not exact:
+                text_width, text_height = self.estimate_text_size(row, max_text_width)
+                estimated = True
+            else:
+                document = self.document_for(row, max_text_width)
+                if row.kind == "user":
+                    # User bubbles shrink to fit short messages
+                    text_width = min(max_text_width, int(document.idealWidth()) + 1)
+                    if text_width != max_text_width:
+                        document.setTextWidth(text_width)
+                        self.store_document(row, text_width, document)
+                text_height = int(document.size().height())
+                if measured is not None:
+                    if len(measured) >= RenderedReply.MAX_WIDTHS:
+                        measured.clear()
+                    measured[key] = text_height
             
-            bubble_layout.addWidget(message_container)
-            bubble_layout.addWidget(time_container)
+            bubble_height = text_height + 2 * self.PADDING_Y
+            if row.kind == "bot":
+                bubble_height += 8 + self.COPY_HEIGHT
+            bubble_width = text_width + 2 * self.PADDING_X
+            x = width - self.MARGIN - bubble_width if row.kind == "user" else self.MARGIN
+            bubble = QRect(x, self.ROW_SPACING + self.BUBBLE_SPACING, bubble_width, bubble_height)
+            height = bubble.bottom() + 1 + 6 + self.TIME_HEIGHT + self.BUBBLE_SPACING + self.ROW_SPACING
+        elif row.kind == "system":
+            text_rect = self.system_text_rect(row, width)
+            height = text_rect.height() + 2 * 8 + 2 * 5 + 2 * self.ROW_SPACING
+        else:
+            height = self.LOADING_HEIGHT + 2 * self.ROW_SPACING
+        
+        size = QSize(width, height)
+        row.layout = (width, size, bubble, estimated)
+        if layout is not None and layout[0] == width and layout[3] and layout[1] != size:
+            # The view still positions this row by its estimate; the next materialize fixes that
+            self.view.needs_relayout = True
+        return size, bubble
+    
+    def system_text_rect(self, row, width):
+        available = QRect(50 + 8, 0, max(40, width - 2 * (50 + 8)), 0)
+        flags = Qt.AlignmentFlag.AlignCenter | Qt.TextFlag.TextWordWrap
+        return QFontMetrics(self.system_font).boundingRect(available, int(flags), row.text)
+    
+    def text_rect(self, row, bubble):
+        """Where a message's text sits, relative to the row"""
+        document = self.document_for(row, bubble.width() - 2 * self.PADDING_X)
+        return QRect(bubble.left() + self.PADDING_X, bubble.top() + self.PADDING_Y,
+                     bubble.width() - 2 * self.PADDING_X, int(document.size().height()) + 1)
+    
+    def plain_text(self, row):
+        if row.shown < len(self.pieces_for(row)):
+            # Hidden pieces are never parsed: copy the text the reply was rendered from
+            if row.source is not None:
+                return row.source
+            return unescape(self.TAG.sub("", self.LINE_BREAK.sub("\n", row.text)))
+        _, bubble = self.row_layout(row, self.view.viewport().width())
+        return self.document_for(row, bubble.width() - 2 * self.PADDING_X).toPlainText()
+    
+    def copy_rect(self, bubble):
+        return QRect(bubble.right() - self.PADDING_X - self.COPY_WIDTH + 1,
+                     bubble.bottom() - self.PADDING_Y - self.COPY_HEIGHT + 1,
+                     self.COPY_WIDTH, self.COPY_HEIGHT)
+    
+    def expand_rect(self, bubble):
+        return QRect(bubble.left() + self.PADDING_X, bubble.bottom() - self.PADDING_Y - self.COPY_HEIGHT + 1,
+                     self.EXPAND_WIDTH, self.COPY_HEIGHT)
+    
+    def sizeHint(self, option, index):
+        # Called for every row on each relayout, so the cached case stays minimal
+        row = self.view.model().rows[index.row()]
+        width = self.view.viewport().width()
+        if row.layout is not None and row.layout[0] == width:
+            return row.layout[1]
+        return self.row_layout(row, width, exact=False)[0]
+    
+    def paint(self, painter, option, index):
+        row = index.data(TranscriptModel.RowRole)
+        width = option.rect.width()
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.translate(option.rect.topLeft())
+        if row.kind in ("user", "bot"):
+            # Part of the row inside the viewport, so tall replies only draw what shows
+            visible = option.rect.intersected(self.view.viewport().rect()).translated(-option.rect.topLeft())
+            self.paint_bubble(painter, row, width, visible)
+        elif row.kind == "system":
+            self.paint_system(painter, row, width)
+        else:
+            self.paint_loading(painter, width)
+        painter.restore()
+    
+    def paint_bubble(self, painter, row, width, visible):
+        # Painting never measures; materialize_visible does that for rows in view
+        _, bubble = self.row_layout(row, width, exact=False)
+        
+        # Gradient background, with the corner nearest the sender kept tight
+        gradient = QLinearGradient(QPointF(bubble.topLeft()), QPointF(bubble.bottomRight()))
+        if row.kind == "user":
+            gradient.setColorAt(0, QColor("#A575FF"))
+            gradient.setColorAt(1, QColor("#9F6EFF"))
+            path = bubble_path(QRectF(bubble), 20, 8, 20, 20)
+        else:
+            gradient.setColorAt(0, QColor("#363636"))
+            gradient.setColorAt(1, QColor("#2D2D30"))
+            path = bubble_path(QRectF(bubble), 8, 20, 20, 20)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.fillPath(path, gradient)
+        
+        # Message text, unless the hover editor is showing it
+        if row is not self.editing_row:
+            document = self.document_for(row, bubble.width() - 2 * self.PADDING_X)
+            painter.save()
+            painter.translate(bubble.left() + self.PADDING_X, bubble.top() + self.PADDING_Y)
+            context = QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QPalette.ColorRole.Text, QColor("white"))
+            context.clip = QRectF(visible.translated(-bubble.left() - self.PADDING_X, -bubble.top() - self.PADDING_Y))
+            document.documentLayout().draw(painter, context)
+            painter.restore()
+        
+        # Copy button for bot messages
+        if row.kind == "bot":
+            button = self.copy_rect(bubble)
+            painter.setBrush(QColor("#4CAF50" if row.copied else "#5D4E9E"))
+            painter.drawRoundedRect(QRectF(button), 8, 8)
+            painter.setPen(QColor("white"))
+            painter.setFont(self.small_font)
+            painter.drawText(button, Qt.AlignmentFlag.AlignCenter, "✓ Copied!" if row.copied else "Copy")
             
-            # Left-align the bubble
-            main_layout.addSpacing(20)  # Increased left margin
-            main_layout.addWidget(bubble_container)
-            main_layout.addStretch(1)
-        
-        # Set the frame to be transparent
-        self.setStyleSheet("background: transparent; border: none;")
-        
-        # Adjust sizing with improved width calculations
-        parent_width = self.parent().width() if self.parent() else 1200  # Increased default width
-        max_width = int(parent_width * 0.85)  # Adjusted to 85% of parent width for better balance
-        message_container.setMaximumWidth(max_width)
-        
-        # For bot messages, adjust sizing for dynamic content
-        if not self.is_user:
-            # Set reasonable minimum height
-            self.message.setMinimumHeight(30)  # Reduced minimum height to better fit smaller responses
-            # Call initial resize adjustment
-            self.adjust_text_size()
-        
-        # Create size policies that work across Qt versions
-        expanding_policy = QSizePolicy()
-        expanding_policy.setHorizontalStretch(1)
-        expanding_policy.setHorizontalPolicy(QSizePolicy.Expanding if not hasattr(QSizePolicy, 'Policy') else QSizePolicy.Policy.Expanding)
-        expanding_policy.setVerticalPolicy(QSizePolicy.Minimum if not hasattr(QSizePolicy, 'Policy') else QSizePolicy.Policy.Minimum)
-        
-        preferred_policy = QSizePolicy()
-        preferred_policy.setHorizontalPolicy(QSizePolicy.Preferred if not hasattr(QSizePolicy, 'Policy') else QSizePolicy.Policy.Preferred)
-        preferred_policy.setVerticalPolicy(QSizePolicy.Minimum if not hasattr(QSizePolicy, 'Policy') else QSizePolicy.Policy.Minimum)
-        
-        # Apply size policies
-        self.setSizePolicy(expanding_policy)
-        bubble_container.setSizePolicy(preferred_policy)
-        message_container.setSizePolicy(preferred_policy)
-        
-    def copy_text_to_clipboard(self):
-        """Copy the plain text content to clipboard with improved feedback"""
-        clipboard = QApplication.clipboard()
-        clipboard.setText(self.message.toPlainText())
-        
-        # Show a temporary tooltip with improved position
-        QToolTip.showText(self.sender().mapToGlobal(QPoint(0, -30)), "Copied to clipboard!", self)
-        
-        # Change the button text temporarily with improved visual feedback
-        sender = self.sender()
-        original_text = sender.text()
-        sender.setText("✓ Copied!")
-        
-        # Save the original style and apply a success style
-        original_style = sender.styleSheet()
-        sender.setStyleSheet("""
-            background-color: #4CAF50;
-            color: white;
-            border-radius: 8px;
-            padding: 6px 12px;
-            font-size: 12px;
-            margin-top: 8px;
-            font-weight: 500;
-        """)
+            # Expander for long replies
+            if len(self.pieces_for(row)) > 1:
+                button = self.expand_rect(bubble)
+                painter.setPen(Qt.PenStyle.NoPen)
+                painter.setBrush(QColor("#5D4E9E"))
+                painter.drawRoundedRect(QRectF(button), 8, 8)
+                painter.setPen(QColor("white"))
+                painter.drawText(button, Qt.AlignmentFlag.AlignCenter, "Show less ▴" if row.expanded else "Show more ▾")
+        
+        # Time stamp under the bubble, on the sender's side
+        painter.setPen(QColor(255, 255, 255, 178))
+        painter.setFont(self.small_font)
+        time_rect = QRect(bubble.left() + 10, bubble.bottom() + 1 + 6, bubble.width() - 20, self.TIME_HEIGHT)
+        alignment = Qt.AlignmentFlag.AlignRight if row.kind == "user" else Qt.AlignmentFlag.AlignLeft
+        painter.drawText(time_rect, alignment | Qt.AlignmentFlag.AlignVCenter, row.timestamp)
+    
+    def paint_system(self, painter, row, width):
+        size, _ = self.row_layout(row, width, exact=False)
+        box = QRect(50, self.ROW_SPACING + 5, width - 100, size.height() - 2 * self.ROW_SPACING - 10)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(163, 112, 247, 25))
+        painter.drawRoundedRect(QRectF(box), 10, 10)
+        painter.setPen(QColor("#A370F7"))
+        painter.setFont(self.system_font)
+        painter.drawText(box.adjusted(8, 8, -8, -8),
+                         int(Qt.AlignmentFlag.AlignCenter | Qt.TextFlag.TextWordWrap), row.text)
+    
+    def paint_loading(self, painter, width):
+        box = QRect(self.MARGIN, self.ROW_SPACING, width - 2 * self.MARGIN, self.LOADING_HEIGHT)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(45, 45, 48, 178))
+        painter.drawRoundedRect(QRectF(box), 10, 10)
+        
+        text = "Gemini is cooking up something fire..."
+        painter.setPen(QColor("#A370F7"))
+        painter.setFont(self.system_font)
+        text_width = QFontMetrics(self.system_font).horizontalAdvance(text)
+        painter.drawText(box.adjusted(15, 0, 0, 0), Qt.AlignmentFlag.AlignVCenter, text)
+        
+        # Indeterminate progress bar, animated by the view's loading timer
+        track = QRect(box.left() + 15 + text_width + 15, box.center().y() - 2,
+                      max(0, box.right() - 15 - (box.left() + 15 + text_width + 15)), 5)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor("#333"))
+        painter.drawRoundedRect(QRectF(track), 2, 2)
+        chunk_width = track.width() // 4
+        phase = (time.monotonic() % 1.5) / 1.5
+        chunk_x = track.left() + int((track.width() + chunk_width) * phase) - chunk_width
+        chunk = QRect(chunk_x, track.top(), chunk_width, track.height()).intersected(track)
+        painter.setBrush(QColor("#A370F7"))
+        painter.drawRoundedRect(QRectF(chunk), 2, 2)
+    
+    def createEditor(self, parent, option, index):
+        """Read-only text edit laid over the hovered bubble, so its text can be selected"""
+        row = self.view.model().rows[index.row()]
+        _, bubble = self.row_layout(row, option.rect.width())
+        editor = QTextEdit(parent)
+        editor.setReadOnly(True)
+        editor.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse |
+                                       Qt.TextInteractionFlag.TextSelectableByKeyboard)
+        editor.setFrameShape(QFrame.Shape.NoFrame)
+        editor.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        editor.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        editor.setStyleSheet("background: transparent; color: white; border: none;")
+        editor.viewport().setAutoFillBackground(False)
+        
+        # Copy the cached layout instead of parsing the HTML again
+        document = self.document_for(row, bubble.width() - 2 * self.PADDING_X).clone(editor)
+        document.setDefaultFont(self.text_font)
+        document.setDocumentMargin(2)
+        editor.setDocument(document)
+        return editor
+    
+    def setEditorData(self, editor, index):
+        pass
+    
+    def setModelData(self, editor, model, index):
+        pass
+    
+    def updateEditorGeometry(self, editor, option, index):
+        row = self.view.model().rows[index.row()]
+        _, bubble = self.row_layout(row, option.rect.width())
+        editor.setGeometry(self.text_rect(row, bubble).translated(option.rect.topLeft()))
+    
+    def button_at(self, row, rect, pos):
+        """Signal of the painted button at `pos` in a row drawn at `rect`, or None"""
+        if row.kind != "bot":
+            return None
+        _, bubble = self.row_layout(row, rect.width())
+        bubble = bubble.translated(rect.topLeft())
+        if self.copy_rect(bubble).contains(pos):
+            return self.copy_requested
+        if len(self.pieces_for(row)) > 1 and self.expand_rect(bubble).contains(pos):
+            return self.expand_requested
+        return None
+
+class ScrollAnchor(QObject):
+    """Keeps a scroll bar at the bottom while the user is reading the latest rows"""
+    SLACK = 24  # Pixels from the bottom that still count as being at the bottom
+    
+    def __init__(self, scroll_bar, parent=None):
+        super().__init__(parent)
+        self.scroll_bar = scroll_bar
+        self.following = True
+        scroll_bar.valueChanged.connect(self.on_value_changed)
+        scroll_bar.rangeChanged.connect(self.on_range_changed)
+    
+    def on_value_changed(self, value):
+        self.following = value >= self.scroll_bar.maximum() - self.SLACK
+    
+    def on_range_changed(self, minimum, maximum):
+        # New content only moves the view if the user was already at the bottom
+        if self.following:
+            self.scroll_bar.setValue(maximum)
+    
+    def follow(self):
+        """Jump to the bottom and keep following it"""
+        self.following = True
+        self.scroll_bar.setValue(self.scroll_bar.maximum())
+
+class TranscriptView(QListView):
+    """Scrollable chat transcript; only rows in view are painted"""
+    SHOW_MORE_MS = 8  # Time per frame spent laying out an expanded reply
+    
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.delegate = ChatBubbleDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(20)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.anchor = ScrollAnchor(self.verticalScrollBar(), self)
+        
+        # Messages are painted; a selectable editor covers only the hovered one
+        self.setMouseTracking(True)
+        self.editor_index = QPersistentModelIndex()
+        model.modelReset.connect(self.reset_documents)
+        
+        # Keep the loading placeholders moving while any are shown
+        self.loading_timer = QTimer(self)
+        self.loading_timer.setInterval(33)
+        self.loading_timer.timeout.connect(self.animate_loading_rows)
+        model.rowsInserted.connect(self.update_loading_timer)
+        model.rowsRemoved.connect(self.update_loading_timer)
+        model.modelReset.connect(self.update_loading_timer)
+        
+        # Rows far from the viewport only have estimated heights; the ones
+        # about to be seen are measured exactly a frame after each scroll
+        self.needs_relayout = False
+        self.verticalScrollBar().valueChanged.connect(self.schedule_materialize)
+        self.verticalScrollBar().rangeChanged.connect(self.schedule_materialize)
+        self.delegate.expand_requested.connect(self.toggle_expanded)
+    
+    def dataChanged(self, top_left, bottom_right, roles=()):
+        super().dataChanged(top_left, bottom_right, roles)
+        # A row whose text changed has to be measured and laid out again
+        row = top_left.data(TranscriptModel.RowRole)
+        if row.layout is None:
+            if QModelIndex(self.editor_index) == top_left:
+                self.close_hover_editor(keep_selection=False)
+            # One layout pass per frame however many rows changed, not one per row
+            self.needs_relayout = True
+            self.schedule_materialize()
+            # An expanded reply keeps laying out its pieces, a few per frame
+            if row.expanded and row.shown < len(self.delegate.pieces_for(row)):
+                self.model().scheduler.defer(("show more", row), lambda: self.show_more(row))
+    
+    def open_hover_editor(self, index):
+        if QModelIndex(self.editor_index) == index:
+            return
+        # Don't take away a selection the user is about to copy
+        if not self.close_hover_editor():
+            return
+        row = self.model().rows[index.row()]
+        if row.kind in ("user", "bot"):
+            self.delegate.editing_row = row
+            self.editor_index = QPersistentModelIndex(index)
+            self.openPersistentEditor(index)
+    
+    def close_hover_editor(self, keep_selection=True):
+        """Close the hover editor; returns False if it was kept for its selection"""
+        index = QModelIndex(self.editor_index)
+        if index.isValid():
+            editor = self.indexWidget(index)
+            if keep_selection and editor is not None and editor.textCursor().hasSelection():
+                return False
+            self.closePersistentEditor(index)
+            self.update(index)
+        self.editor_index = QPersistentModelIndex()
+        self.delegate.editing_row = None
+        return True
+    
+    def button_at(self, event):
+        """(signal, row) of the painted button under the mouse, or None"""
+        if event.button() != Qt.MouseButton.LeftButton:
+            return None
+        pos = event.position().toPoint()
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return None
+        row = self.model().rows[index.row()]
+        signal = self.delegate.button_at(row, self.visualRect(index), pos)
+        return (signal, row) if signal is not None else None
+    
+    # Buttons are caught here, before the item view: while the hover editor
+    # is open on a row, clicks on it never reach the delegate's editorEvent
+    def mousePressEvent(self, event):
+        if self.button_at(event) is not None:
+            event.accept()
+            return
+        super().mousePressEvent(event)
+    
+    def mouseReleaseEvent(self, event):
+        button = self.button_at(event)
+        if button is not None:
+            event.accept()
+            signal, row = button
+            signal.emit(row)
+            return
+        super().mouseReleaseEvent(event)
+    
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        index = self.indexAt(event.position().toPoint())
+        if index.isValid():
+            self.open_hover_editor(index)
+    
+    def leaveEvent(self, event):
+        self.close_hover_editor()
+        super().leaveEvent(event)
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_materialize()
+    
+    def schedule_materialize(self, *args):
+        self.model().scheduler.schedule((self, "materialize"), self.materialize_visible)
+    
+    def materialize_visible(self):
+        """Measure estimated rows within a screen of the viewport and lay out again if needed"""
+        rows = self.model().rows
+        height = self.viewport().height()
+        width = self.viewport().width()
+        top = self.indexAt(QPoint(0, 0))
+        if not rows or not top.isValid():
+            if self.needs_relayout:
+                self.scheduleDelayedItemsLayout()
+            self.needs_relayout = False
+            return
         
-        # Reset button after a short delay
-        QTimer.singleShot(1500, lambda: self.reset_button(sender, original_text, original_style))
+        first = top.row()
+        span = 0
+        position = first
+        while position > 0 and span < height:
+            position -= 1
+            size, _ = self.delegate.row_layout(rows[position], width, exact=False)
+            span += size.height()
+        span = 0
+        while position < len(rows) and span < 3 * height:
+            row = rows[position]
+            if row.on_shown is not None:
+                on_shown, row.on_shown = row.on_shown, None
+                on_shown()
+            before = row.layout
+            size, _ = self.delegate.row_layout(row, width)
+            if before is not None and before[0] == width and before[1] != size:
+                self.needs_relayout = True
+            if position >= first:
+                span += size.height()
+            position += 1
+        
+        if not self.needs_relayout:
+            return
+        self.needs_relayout = False
+        # Keep the row at the top of the viewport where it was while heights above it settle
+        offset = self.visualRect(top).top()
+        self.scheduleDelayedItemsLayout()
+        self.executeDelayedItemsLayout()
+        if not self.anchor.following:
+            scroll_bar = self.verticalScrollBar()
+            scroll_bar.setValue(scroll_bar.value() + self.visualRect(top).top() - offset)
     
-    def reset_button(self, button, original_text, original_style):
-        """Reset button to original state with animation effect"""
-        button.setText(original_text)
-        button.setStyleSheet(original_style)
+    def toggle_expanded(self, row):
+        row.expanded = not row.expanded
+        if row.expanded:
+            # Stay at the part being read instead of following the reply as it grows
+            self.anchor.following = False
+            self.show_more(row)
+        else:
+            row.shown = 1
+            self.model().invalidate(row)
     
-    def adjust_text_size(self):
-        """Dynamically adjust the height of the QTextEdit based on its content with improved calculations"""
-        # Calculate the document height
-        document = self.message.document()
-        document_height = document.size().height()
-        
-        # Add padding proportional to content size
-        padding = 24  # Base padding
-        new_height = document_height + padding
-        
-        # Set reasonable constraints
-        min_height = 40  # Adjusted minimum height
-        max_height = 600  # More reasonable maximum (about 25-30 lines of text)
-        
-        # Apply height constraints
-        if new_height < min_height:
-            new_height = min_height
-        elif new_height > max_height:
-            new_height = max_height
-            # Enable scrollbar if content exceeds max height
-            self.message.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+    def show_more(self, row):
+        """Lay out pieces of an expanded reply for part of a frame; the rest follows in later frames"""
+        deadline = time.monotonic() + self.SHOW_MORE_MS / 1000
+        grown = False
+        while row.expanded and time.monotonic() < deadline and self.delegate.show_next_piece(row):
+            grown = True
+        if grown:
+            self.model().invalidate(row)
+    
+    def reset_documents(self):
+        self.editor_index = QPersistentModelIndex()
+        self.delegate.editing_row = None
+        self.delegate.clear_documents()
+    
+    def update_loading_timer(self):
+        if self.model().loading_rows:
+            self.loading_timer.start()
         else:
-            # Disable scrollbar for content that fits
-            self.message.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        
-        # Apply the new height
-        self.message.setFixedHeight(int(new_height))
-        
-        # Force layout update
-        self.message.updateGeometry()
-        if self.parent():
-            self.parent().updateGeometry()
+            self.loading_timer.stop()
+    
+    def animate_loading_rows(self):
+        model = self.model()
+        remaining = model.loading_rows
+        for position in range(len(model.rows) - 1, -1, -1):
+            if not remaining:
+                break
+            if model.rows[position].kind == "loading":
+                self.update(model.index(position))
+                remaining -= 1
 
+class LayoutScheduler(QObject):
+    """Coalesces layout work so each piece of it runs at most once per frame"""
+    FRAME_MS = 16
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pending = {}  # key -> callback, in the order first requested
+        self.deferred = {}  # key -> callback, kept out of the frame being flushed
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.FRAME_MS)
+        self.timer.timeout.connect(self.flush)
+        self.relayouts = 0
+        self.frames = 0
+    
+    def schedule(self, key, callback):
+        """Run callback with the next frame; a newer request for the same key replaces it"""
+        self.pending[key] = callback
+        if not self.timer.isActive():
+            self.timer.start()
+    
+    def defer(self, key, callback):
+        """Like schedule, but never joins a frame already being flushed; for work spread over frames"""
+        self.deferred[key] = callback
+        if not self.timer.isActive():
+            self.timer.start()
+    
+    def cancel(self, key):
+        self.pending.pop(key, None)
+        self.deferred.pop(key, None)
+    
+    def flush(self):
+        self.pending.update(self.deferred)
+        self.deferred = {}
+        # Work scheduled while flushing (e.g. a rendered reply dirtying its row) joins this frame
+        while self.pending:
+            pending, self.pending = self.pending, {}
+            for callback in pending.values():
+                callback()
+            self.relayouts += len(pending)
+        self.frames += 1
+    
+    def take_stats(self):
+        """(relayouts, frames) since the last call"""
+        stats = (self.relayouts, self.frames)
+        self.relayouts = 0
+        self.frames = 0
+        return stats
 
 class ChatInput(QWidget):
     def __init__(self, parent=None):
@@ -648,36 +2729,13 @@ class ChatInput(QWidget):
         self.text_input.clear()
         
 
-class LoadingIndicator(QWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        layout = QHBoxLayout(self)
-        
-        self.label = QLabel("Gemini is cooking up something fire...")
-        self.label.setStyleSheet("color: #A370F7; font-style: italic;")
-        
-        self.progress = QProgressBar()
-        self.progress.setRange(0, 0)  # Indeterminate progress
-        self.progress.setTextVisible(False)
-        self.progress.setMaximumHeight(5)
-        self.progress.setStyleSheet("""
-            QProgressBar {
-                border: none;
-                border-radius: 2px;
-                background-color: #333;
-            }
-            
-            QProgressBar::chunk {
-                background-color: #A370F7;
-                border-radius: 2px;
-            }
-        """)
-        
-        layout.addWidget(self.label)
-        layout.addWidget(self.progress)
-        
-        self.setMaximumHeight(50)
-        self.setStyleSheet("background-color: rgba(45, 45, 48, 0.7); border-radius: 10px; padding: 5px;")
+class PendingReply:
+    """GUI-side state of a chat request that hasn't finished yet"""
+    def __init__(self, handle):
+        self.handle = handle
+        self.loading_row = None
+        self.row = None
+        self.renderer = MarkdownRenderer()
 
 class EmojiSelector(QFrame):
     emoji_selected = pyqtSignal(str)
@@ -748,11 +2806,41 @@ class ThemeSelector(QComboBox):
 class GenZChatbot(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.chat_history = []
+        self.conversation = Conversation()
         self.model = None
         self.current_image = None
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.context_window = ContextWindowManager(self.settings["context_token_budget"])
+        self.response_cache = ResponseCache(RESPONSE_CACHE_DIR)
+        self.image_payloads = ImagePayloadCache(ImagePreprocessor())
+        self.http = HttpClient()
+        self.blob_store = BlobStore(TEMP_DIR, DEFAULT_SETTINGS["temp_store_max_mb"] * 1024 * 1024)
+        self.executor = RequestExecutor(JOB_CONCURRENCY, self)
+        self.image_decoder = ImageDecoder(self.executor, DEFAULT_SETTINGS["thumbnail_cache_mb"] * 1024 * 1024, self)
+        self.code_highlighter = CodeHighlighter(self.executor, parent=self)
+        self.post_processor = ResponsePostProcessor()
+        self.render_cache = RenderCache()
+        self.pending_replies = {}
+        self.image_jobs = {}
+        self.image_progress_bytes = {}
+        self.image_batch_size = 0  # Downloads started for the current batch
+        self.image_batch_results = []
+        self.result_pixmaps = ScaledPixmapCache()
+        self.layout_scheduler = LayoutScheduler(self)
+        
+        # Rescale the result image once a window drag settles
+        self.result_resize_timer = QTimer(self)
+        self.result_resize_timer.setSingleShot(True)
+        self.result_resize_timer.setInterval(120)
+        self.result_resize_timer.timeout.connect(self.rescale_generated_image)
         self.init_ui()
         self.load_config()
+        if self.settings["restore_session"]:
+            self.restore_session()
+        
+        # Tidy up the image store and the reply cache in the background
+        self.executor.submit(StoreSweepJob(self.blob_store))
+        self.executor.submit(StoreSweepJob(self.response_cache))
         
     def init_ui(self):
         self.setWindowTitle("Vibe Check ✨ GenZ Gemini Chatbot")
@@ -907,24 +2995,12 @@ class GenZChatbot(QMainWindow):
         header_layout.addSpacing(18)
         header_layout.addLayout(header_buttons_layout)
         
-        # Enhanced chat area with improved styling
-        self.chat_area = QWidget()
-        self.chat_layout = QVBoxLayout(self.chat_area)
-        self.chat_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.chat_layout.setSpacing(30)  # Increased spacing for better readability
-        # self.chat_layout.setContentsMargins(40, 40, 40, 40)  # Increased margins
-        
-        # Make the chat area expand properly
-        self.chat_area.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        
-        # Scroll area for chat with enhanced styling
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setWidget(self.chat_area)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.scroll_area.setStyleSheet("""
-            QScrollArea {
+        # Enhanced chat area with improved styling; bubbles are painted rows of one list view
+        self.transcript = TranscriptModel(self.layout_scheduler, self)
+        self.transcript_view = TranscriptView(self.transcript)
+        self.transcript_view.delegate.copy_requested.connect(self.copy_text_to_clipboard)
+        self.transcript_view.setStyleSheet("""
+            QListView {
                 border: none;
                 background-color: #1A1A1D;
             }
@@ -1069,9 +3145,32 @@ class GenZChatbot(QMainWindow):
         """)
         self.send_button.clicked.connect(self.send_message)
         
+        # Stop button, only shown while a reply is pending
+        self.stop_button = QPushButton("⏹")
+        self.stop_button.setToolTip("Stop generating")
+        self.stop_button.setFixedSize(50, 50)
+        self.stop_button.setStyleSheet("""
+            QPushButton {
+                background-color: #3B3B3D;
+                border-radius: 25px;
+                font-size: 22px;
+                color: white;
+                border: 1px solid #555;
+            }
+            QPushButton:hover {
+                background-color: #4E4E50;
+            }
+            QPushButton:pressed {
+                background-color: #555558;
+            }
+        """)
+        self.stop_button.clicked.connect(self.stop_generation)
+        self.stop_button.setVisible(False)
+        
         input_controls.addWidget(self.image_upload_btn)
         input_controls.addWidget(self.emoji_btn)
         input_controls.addWidget(self.message_input)
+        input_controls.addWidget(self.stop_button)
         input_controls.addWidget(self.send_button)
         
         # Enhanced image preview with improved styling
@@ -1217,6 +3316,34 @@ class GenZChatbot(QMainWindow):
         """)
         generate_button.clicked.connect(self.generate_image)
         
+        # How many variants of the prompt to render in parallel
+        variants_layout = QHBoxLayout()
+        variants_label = QLabel("Variants")
+        variants_label.setStyleSheet("color: #CCC; font-size: 14px;")
+        self.variant_count_input = QSpinBox()
+        self.variant_count_input.setRange(1, 8)
+        self.variant_count_input.setValue(1)
+        self.variant_count_input.setStyleSheet("""
+            QSpinBox {
+                background-color: #2D2D30;
+                border: 1px solid #444;
+                border-radius: 8px;
+                padding: 4px 8px;
+                color: white;
+                font-size: 14px;
+            }
+        """)
+        
+        # Skip the generated-image cache and fetch fresh images
+        self.force_regenerate_input = QCheckBox("Force regenerate")
+        self.force_regenerate_input.setStyleSheet("color: #CCC; font-size: 14px; margin-left: 16px;")
+        
+        variants_layout.addStretch()
+        variants_layout.addWidget(variants_label)
+        variants_layout.addWidget(self.variant_count_input)
+        variants_layout.addWidget(self.force_regenerate_input)
+        variants_layout.addStretch()
+        
         # Enhanced image result area
         self.image_result_label = QLabel("Your generated image will appear here")
         self.image_result_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -1236,9 +3363,54 @@ class GenZChatbot(QMainWindow):
             QSizePolicy.Policy.Expanding
         )
         
+        # Download progress and cancel button, shown while an image renders
+        self.image_progress = QProgressBar()
+        self.image_progress.setMaximumHeight(8)
+        self.image_progress.setTextVisible(False)
+        self.image_progress.setStyleSheet("""
+            QProgressBar {
+                border: none;
+                border-radius: 4px;
+                background-color: #333;
+                margin: 0px 120px;
+            }
+            QProgressBar::chunk {
+                background-color: #A370F7;
+                border-radius: 4px;
+            }
+        """)
+        self.image_progress.setVisible(False)
+        
+        self.cancel_image_button = QPushButton("Cancel")
+        self.cancel_image_button.setStyleSheet("""
+            QPushButton {
+                background-color: #3B3B3D;
+                border-radius: 15px;
+                padding: 8px 16px;
+                color: white;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #4E4E50;
+            }
+        """)
+        self.cancel_image_button.clicked.connect(self.cancel_image_generation)
+        self.cancel_image_button.setVisible(False)
+        
+        # Thumbnail grid for batch results, filled in as variants complete
+        self.variant_grid_widget = QWidget()
+        self.variant_grid = QGridLayout(self.variant_grid_widget)
+        self.variant_grid.setSpacing(10)
+        self.variant_grid_widget.setVisible(False)
+        self.variant_buttons = []
+        
         image_generation_layout.addWidget(prompt_label)
         image_generation_layout.addWidget(self.image_prompt_input)
+        image_generation_layout.addLayout(variants_layout)
         image_generation_layout.addWidget(generate_button)
+        image_generation_layout.addWidget(self.image_progress)
+        image_generation_layout.addWidget(self.cancel_image_button, alignment=Qt.AlignmentFlag.AlignCenter)
+        image_generation_layout.addWidget(self.variant_grid_widget, alignment=Qt.AlignmentFlag.AlignCenter)
         image_generation_layout.addWidget(self.image_result_label)
         image_generation_layout.addStretch()
         
@@ -1252,11 +3424,11 @@ class GenZChatbot(QMainWindow):
         
         # Add components to chat page layout
         chat_layout.addWidget(header_widget)
-        chat_layout.addWidget(self.scroll_area)
+        chat_layout.addWidget(self.transcript_view)
         chat_layout.addWidget(input_widget)
         
         # Set proper size policies
-        self.scroll_area.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.transcript_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         input_widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
         
         # Add stacked widget to main layout
@@ -1264,6 +3436,55 @@ class GenZChatbot(QMainWindow):
         
         self.setCentralWidget(main_widget)
         
+        # Status bar for per-request stats
+        self.statusBar().setStyleSheet("""
+            QStatusBar {
+                background-color: #1A1A1D;
+                color: #999;
+                font-size: 12px;
+                border-top: 1px solid #333;
+            }
+        """)
+        
+        # Reply cache counters with a button to drop everything cached
+        self.cache_stats_label = QLabel()
+        self.cache_stats_label.setStyleSheet("color: #999; font-size: 12px; padding: 0px 6px;")
+        clear_cache_button = QPushButton("🗑️")
+        clear_cache_button.setToolTip("Clear cached replies")
+        clear_cache_button.setFixedSize(26, 22)
+        clear_cache_button.setStyleSheet("""
+            QPushButton {
+                background-color: transparent;
+                border-radius: 6px;
+                font-size: 12px;
+            }
+            QPushButton:hover {
+                background-color: #333;
+            }
+        """)
+        clear_cache_button.clicked.connect(self.clear_response_cache)
+        
+        # Connection pool stats for the image endpoints
+        http_stats_button = QPushButton("🌐")
+        http_stats_button.setToolTip("HTTP connection pool stats")
+        http_stats_button.setFixedSize(26, 22)
+        http_stats_button.setStyleSheet(clear_cache_button.styleSheet())
+        http_stats_button.clicked.connect(self.show_http_stats)
+        
+        # Layout work per second, shown when debug_layout_stats is on
+        self.layout_stats_label = QLabel()
+        self.layout_stats_label.setStyleSheet(self.cache_stats_label.styleSheet())
+        self.layout_stats_label.setVisible(False)
+        self.layout_stats_timer = QTimer(self)
+        self.layout_stats_timer.setInterval(1000)
+        self.layout_stats_timer.timeout.connect(self.update_layout_stats)
+        
+        self.statusBar().addPermanentWidget(self.layout_stats_label)
+        self.statusBar().addPermanentWidget(self.cache_stats_label)
+        self.statusBar().addPermanentWidget(clear_cache_button)
+        self.statusBar().addPermanentWidget(http_stats_button)
+        self.update_cache_stats()
+        
         # Set position for clear image button (overlay on preview)
         self.clear_image_btn.setParent(self.image_preview)
         self.clear_image_btn.move(10, 10)  # Moved slightly away from edge
@@ -1281,7 +3502,7 @@ class GenZChatbot(QMainWindow):
             font-size: 14px;
         """)
         self.typing_indicator.setVisible(False)
-        self.chat_layout.addWidget(self.typing_indicator)
+        self.typing_indicator.setParent(self.transcript_view)
         
         # Add some placeholder animation for the typing indicator
         self.typing_timer = QTimer()
@@ -1302,32 +3523,17 @@ class GenZChatbot(QMainWindow):
     def get_unsplash_image(self, query):
         """Get a free image from Unsplash based on the query with improved error handling"""
         try:
-            # Disable SSL warnings for this request only
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            
             # Use a more reliable Unsplash Source API endpoint
             base_url = "https://source.unsplash.com/random?"
             search_url = base_url + urllib.parse.quote(query)
             
-            # Make request with SSL verification disabled and proper headers
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(search_url, verify=False, allow_redirects=True, timeout=15, headers=headers)
+            # Reuse the pooled connection to the host
+            response = self.http.get(search_url, allow_redirects=True)
             
             if response.status_code == 200:
-                # Save to a temporary file
-                temp_dir = os.path.join(os.path.expanduser("~"), ".genz_chatbot_temp")
-                os.makedirs(temp_dir, exist_ok=True)
-                
-                # Create a filename based on timestamp
-                filename = os.path.join(temp_dir, f"image_{int(datetime.now().timestamp())}.jpg")
-                
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
-                
-                return filename
+                # Save to the blob store, named by content
+                ext = IMAGE_EXTENSIONS.get(detect_mime_type(response.content[:16]), "jpg")
+                return self.blob_store.put_bytes(response.content, ext)
             else:
                 print(f"Failed to get image: Status code {response.status_code}")
                 return None
@@ -1347,15 +3553,8 @@ class GenZChatbot(QMainWindow):
         # Update image preview clear button position
         self.update_clear_button_position()
         
-        # If we have an image in the result label, make sure it's properly sized
-        if hasattr(self, 'image_result_label') and self.image_result_label.pixmap():
-            pixmap = self.image_result_label.pixmap()
-            max_width = self.image_result_label.width() - 40
-            max_height = self.image_result_label.height() - 40
-            
-            if pixmap.width() > max_width or pixmap.height() > max_height:
-                scaled_pixmap = pixmap.scaled(max_width, max_height, Qt.AspectRatioMode.KeepAspectRatio)
-                self.image_result_label.setPixmap(scaled_pixmap)
+        # Resize the result image once the drag settles, not on every frame
+        self.result_resize_timer.start()
     
     def set_dark_theme(self):
         dark_palette = QPalette()
@@ -1426,6 +3625,8 @@ class GenZChatbot(QMainWindow):
             try:
                 with open(CONFIG_FILE, 'r') as f:
                     config = json.load(f)
+                self.settings.update({key: config[key] for key in DEFAULT_SETTINGS if key in config})
+                self.apply_settings()
                 if "api_key" in config:
                     self.setup_gemini(config["api_key"])
                 else:
@@ -1435,10 +3636,36 @@ class GenZChatbot(QMainWindow):
         else:
             self.get_api_key()
     
+    def apply_settings(self):
+        self.context_window.budget = self.settings["context_token_budget"]
+        self.context_window.pinned = []
+        if self.settings["system_prompt"]:
+            self.context_window.pin(self.settings["system_prompt"])
+        self.response_cache.max_entries = self.settings["response_cache_entries"]
+        self.response_cache.ttl_seconds = self.settings["response_cache_ttl_hours"] * 3600
+        self.image_payloads.preprocessor.max_edge = self.settings["image_max_edge"]
+        self.image_payloads.preprocessor.quality = self.settings["image_quality"]
+        self.image_payloads.upload_mbps = self.settings["upload_mbps"]
+        self.http.configure(self.settings["http_pool_size"],
+                            self.settings["http_connect_timeout"],
+                            self.settings["http_read_timeout"])
+        self.blob_store.max_bytes = self.settings["temp_store_max_mb"] * 1024 * 1024
+        self.image_decoder.max_bytes = self.settings["thumbnail_cache_mb"] * 1024 * 1024
+        self.post_processor.reseed(self.settings["genz_seed"])
+        self.transcript_view.delegate.max_document_bytes = self.settings["document_cache_mb"] * 1024 * 1024
+        self.transcript_view.delegate.evict_documents()
+        self.layout_stats_label.setVisible(self.settings["debug_layout_stats"])
+        if self.settings["debug_layout_stats"]:
+            self.layout_stats_timer.start()
+        else:
+            self.layout_stats_timer.stop()
+    
     def save_config(self, api_key):
         os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+        config = dict(self.settings)
+        config["api_key"] = api_key
         with open(CONFIG_FILE, 'w') as f:
-            json.dump({"api_key": api_key}, f)
+            json.dump(config, f)
     
     def get_api_key(self):
         dialog = ApiKeyDialog(self)
@@ -1497,49 +3724,60 @@ class GenZChatbot(QMainWindow):
             QMessageBox.critical(self, "Error", f"Could not initialize Gemini: {str(e)}")
     
     def add_message_bubble(self, content, is_user=True):
-        bubble = ChatBubble(content, is_user)
-        self.chat_layout.addWidget(bubble)
-        
-        # Auto scroll to bottom
-        QApplication.processEvents()
-        scroll_bar = self.scroll_area.verticalScrollBar()
-        scroll_bar.setValue(scroll_bar.maximum())
-        
-        # Update chat history
-        role = "user" if is_user else "assistant"
+        text = content.get("text", "") if isinstance(content, dict) else content
+        row = self.transcript.append("user" if is_user else "bot", text)
+        if isinstance(content, dict):
+            row.source = content.get("markdown")
+        self.add_to_history(content, is_user)
+        return row
+    
+    def add_message_bubbles(self, messages):
+        """Append many (content, is_user) messages at once, e.g. a restored session"""
+        entries = []
+        for content, is_user in messages:
+            text = content.get("text", "") if isinstance(content, dict) else content
+            entries.append(("user" if is_user else "bot", text))
+            self.add_to_history(content, is_user)
+        return self.transcript.extend(entries)
+    
+    def add_to_history(self, content, is_user=True):
+        """Record a message in the conversation sent back to the model"""
+        role = "user" if is_user else "model"
         
         # Check if content is a dict or string
         if isinstance(content, dict):
-            history_entry = {
-                "role": role,
-                "content": content.get("text", ""),
-            }
-            
-            # Add image path if present
-            if content.get("images"):
-                history_entry["image"] = content.get("images")[0]
-                
-            self.chat_history.append(history_entry)
+            # Bot replies keep the raw model text next to the rendered HTML
+            text = content.get("raw_text", content.get("text", ""))
+            html = None if is_user else content.get("text", "")
+            image = content["images"][0] if content.get("images") else None
+            turn = self.conversation.append(role, text, html=html, image=image,
+                                            markdown=content.get("markdown"))
         else:
-            self.chat_history.append({"role": role, "content": content})
+            turn = self.conversation.append(role, content)
+        
+        # Keep the running token estimate in step with the history
+        turn.tokens = self.context_window.append(turn.text, images=1 if turn.image else 0)
+        
+        # Stored images the conversation refers to must survive eviction
+        if turn.image:
+            self.blob_store.set_pins("conversation", [t.image for t in self.conversation if t.image])
     
     def add_system_message(self, text):
-        label = QLabel(text)
-        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        label.setStyleSheet("""
-            color: #A370F7;
-            padding: 8px;
-            font-style: italic;
-            background-color: rgba(163, 112, 247, 0.1);
-            border-radius: 10px;
-            margin: 5px 50px;
-        """)
-        self.chat_layout.addWidget(label)
-        
-        # Auto scroll to bottom
-        QApplication.processEvents()
-        scroll_bar = self.scroll_area.verticalScrollBar()
-        scroll_bar.setValue(scroll_bar.maximum())
+        self.transcript.append("system", text)
+    
+    def copy_text_to_clipboard(self, row):
+        """Copy the plain text of a bot reply to the clipboard"""
+        QApplication.clipboard().setText(self.transcript_view.delegate.plain_text(row))
+        QToolTip.showText(QCursor.pos(), "Copied to clipboard!", self.transcript_view)
+        
+        # Show a success state on the button for a moment
+        row.copied = True
+        self.transcript.refresh(row)
+        QTimer.singleShot(1500, lambda: self.reset_copy_button(row))
+    
+    def reset_copy_button(self, row):
+        row.copied = False
+        self.transcript.refresh(row)
     
     def toggle_emoji_selector(self):
         self.emoji_selector.setVisible(not self.emoji_selector.isVisible())
@@ -1563,30 +3801,41 @@ class GenZChatbot(QMainWindow):
         
         if file_name:
             self.current_image = file_name
-            pixmap = QPixmap(file_name)
+            self.clear_image_btn.setVisible(True)
             
-            # Scale the image while maintaining aspect ratio
+            # Decode straight to preview height on the executor
             max_height = 150
-            if pixmap.height() > max_height:
-                pixmap = pixmap.scaledToHeight(max_height)
-                
-            self.image_preview.setPixmap(pixmap)
-            self.image_preview.setVisible(True)
-            self.clear_image_btn.setVisible(True)
+            self.image_decoder.request(file_name, 4 * max_height, max_height,
+                                       lambda image: self.show_image_preview(file_name, image))
+    
+    def show_image_preview(self, file_name, image):
+        # The attachment may have been cleared or replaced while decoding
+        if file_name != self.current_image or image.isNull():
+            return
+        self.image_preview.setPixmap(QPixmap.fromImage(image))
+        self.image_preview.setVisible(True)
     
     def clear_image(self):
         self.current_image = None
+        self.blob_store.set_pins("attachment", [])
         self.image_preview.clear()
         self.image_preview.setVisible(False)
         self.clear_image_btn.setVisible(False)
     
     def generate_image(self):
-        """Generate image using Pollinations API with improved error handling and resizing"""
+        """Generate image(s) using Pollinations API on the executor, keeping the window responsive"""
         prompt = self.image_prompt_input.text().strip()
         if not prompt:
             QMessageBox.warning(self, "Empty Prompt", "Please enter a description for your image.")
             return
-            
+        
+        # Only the latest prompt matters
+        for handle in self.image_jobs.values():
+            handle.cancel()
+        self.image_jobs = {}
+        self.image_progress_bytes = {}
+        self.image_batch_results = []
+        
         # Show loading state
         self.image_result_label.setText("Generating your image... hold tight bestie! ✨")
         self.image_result_label.setStyleSheet("""
@@ -1599,69 +3848,183 @@ class GenZChatbot(QMainWindow):
                 margin: 20px;
             }
         """)
-        QApplication.processEvents()
-
-        try:
-            # Use Pollinations API with direct image generation endpoint
-            url = f"https://image.pollinations.ai/prompt/{urllib.parse.quote(prompt)}"
+        self.image_progress.setRange(0, 0)
+        self.image_progress.setVisible(True)
+        self.cancel_image_button.setVisible(True)
+        
+        count = self.variant_count_input.value()
+        force = self.force_regenerate_input.isChecked()
+        self.reset_variant_grid(count if count > 1 else 0)
+        
+        # Variants differ by seed; the image_generation pool bounds how many run at once
+        base_seed = random.randint(0, 1_000_000) if force else 1
+        for index in range(count):
+            seed = base_seed + index if count > 1 or force else None
+            # The cache key ignores forced seeds, so a forced image replaces the cached one
+            cache_key = ImageGenerationJob.make_cache_key(prompt, index + 1 if count > 1 else None)
             
-            # Download the image with proper timeout and headers
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, timeout=30, verify=False, headers=headers)
+            # Prompts we already rendered come straight from the store
+            cached_path = None if force else self.blob_store.resolve(cache_key)
+            if cached_path:
+                self.add_generated_variant(index, cached_path)
+                continue
             
-            if response.status_code == 200:
-                # Save to a temporary file
-                temp_dir = os.path.join(os.path.expanduser("~"), ".genz_chatbot_temp")
-                os.makedirs(temp_dir, exist_ok=True)
-                temp_file = os.path.join(temp_dir, f"generated_image_{int(datetime.now().timestamp())}.jpg")
-                
-                with open(temp_file, 'wb') as f:
-                    f.write(response.content)
-
-                # Display the image with better size constraints
-                self.display_generated_image(temp_file)
-                
-                # Store the generated image path
-                self.current_image = temp_file
-                
-                # Add success message
-                self.add_system_message("Image generated successfully! Lowkey fire ngl ✨")
-            else:
-                raise Exception(f"Failed to generate image: Status {response.status_code}")
-
-        except Exception as e:
-            error_msg = str(e)
-            self.image_result_label.setText(f"Error: {error_msg}")
-            self.image_result_label.setStyleSheet("""
-                QLabel {
-                    color: #FF5555;
-                    background-color: #2D2D30;
-                    border-radius: 10px;
-                    padding: 20px;
-                    margin: 20px;
-                }
-            """)
-            print(f"Error generating image: {error_msg}")
+            job = ImageGenerationJob(self.http, prompt, self.blob_store, seed=seed, cache_key=cache_key)
+            handle = job.handle
+            job.signals.progress.connect(
+                lambda received, total, handle=handle: self.handle_image_progress(handle, received, total))
+            job.signals.response_ready.connect(
+                lambda result, handle=handle, index=index: self.handle_generated_image(handle, index, result))
+            job.signals.error_occurred.connect(
+                lambda error, handle=handle, index=index: self.handle_image_error(handle, index, error))
+            job.signals.finished.connect(lambda handle=handle: self.finish_image_job(handle))
+            self.image_jobs[handle.id] = self.executor.submit(job)
+        
+        # Finished jobs leave image_jobs, so the progress bar counts against this
+        self.image_batch_size = len(self.image_jobs)
+        if not self.image_jobs:
+            self.finish_image_batch(cached=True)
+    
+    def reset_variant_grid(self, count):
+        """Create `count` empty thumbnail cells, or hide the grid for single images"""
+        for button in self.variant_buttons:
+            self.variant_grid.removeWidget(button)
+            button.deleteLater()
+        self.variant_buttons = []
+        
+        for index in range(count):
+            button = QPushButton("⏳")
+            button.setFixedSize(132, 132)
+            button.setIconSize(QSize(120, 120))
+            button.setEnabled(False)
+            button.setStyleSheet(self.variant_button_style(False))
+            self.variant_grid.addWidget(button, index // 4, index % 4)
+            self.variant_buttons.append(button)
+        self.variant_grid_widget.setVisible(count > 0)
+    
+    def variant_button_style(self, selected):
+        border = "#A370F7" if selected else "#444"
+        return f"""
+            QPushButton {{
+                background-color: #2D2D30;
+                border: 2px solid {border};
+                border-radius: 12px;
+                color: #999;
+                font-size: 20px;
+            }}
+            QPushButton:hover {{
+                border: 2px solid #8A5CF5;
+            }}
+        """
+    
+    def handle_image_progress(self, handle, received, total):
+        if handle.id not in self.image_jobs or handle.cancelled:
+            return
+        self.image_progress_bytes[handle.id] = (received, total)
+        
+        # Overall progress across the batch, once every size is known
+        received_total = sum(r for r, _ in self.image_progress_bytes.values())
+        expected = [t for _, t in self.image_progress_bytes.values()]
+        if len(expected) == self.image_batch_size and all(expected):
+            self.image_progress.setRange(0, sum(expected))
+            self.image_progress.setValue(received_total)
+        if not self.image_batch_results:
+            self.image_result_label.setText(f"Downloading your image... {format_bytes(received_total)} ✨")
+    
+    def handle_generated_image(self, handle, index, result):
+        if handle.id not in self.image_jobs or handle.cancelled:
+            return
+        self.add_generated_variant(index, result["path"])
+    
+    def add_generated_variant(self, index, path):
+        """Show a finished variant in the grid, and in the result area if it's the first"""
+        self.image_batch_results.append(path)
+        self.blob_store.set_pins("batch", self.image_batch_results)
+        
+        if self.variant_buttons:
+            button = self.variant_buttons[index]
+            button.setEnabled(True)
+            button.clicked.connect(lambda: self.select_image_variant(index, path))
+            self.image_decoder.request(path, 120, 120,
+                                       lambda image: self.set_variant_thumbnail(button, image))
+        
+        # Show the first finished image right away
+        if len(self.image_batch_results) == 1:
+            self.select_image_variant(index, path)
+    
+    def set_variant_thumbnail(self, button, image):
+        # The grid is rebuilt for every batch, so the button may be gone
+        if button not in self.variant_buttons or image.isNull():
+            return
+        button.setText("")
+        button.setIcon(QIcon(QPixmap.fromImage(image)))
+    
+    def select_image_variant(self, index, path):
+        """Display a generated image and make it the one download_image saves"""
+        # Display the image with better size constraints; it's kept in
+        # current_image_path, apart from the chat attachment in current_image
+        self.display_generated_image(path)
+        
+        for i, button in enumerate(self.variant_buttons):
+            button.setStyleSheet(self.variant_button_style(i == index))
+    
+    def handle_image_error(self, handle, index, error_msg):
+        if handle.id not in self.image_jobs or handle.cancelled:
+            return
+        print(f"Error generating image: {error_msg}")
+        
+        if self.variant_buttons:
+            self.variant_buttons[index].setText("❌")
+            self.variant_buttons[index].setToolTip(error_msg)
+        if self.image_batch_results:
+            return
+        self.image_result_label.setText(f"Error: {error_msg}")
+        self.image_result_label.setStyleSheet("""
+            QLabel {
+                color: #FF5555;
+                background-color: #2D2D30;
+                border-radius: 10px;
+                padding: 20px;
+                margin: 20px;
+            }
+        """)
+    
+    def finish_image_job(self, handle):
+        if self.image_jobs.pop(handle.id, None) is None or self.image_jobs:
+            return
+        self.finish_image_batch()
+    
+    def finish_image_batch(self, cached=False):
+        self.image_progress.setVisible(False)
+        self.cancel_image_button.setVisible(False)
+        
+        # Add success message once the whole batch is in
+        count = len(self.image_batch_results)
+        if cached:
+            self.add_system_message("Already made that one, here it is again ⚡")
+        elif count == 1:
+            self.add_system_message("Image generated successfully! Lowkey fire ngl ✨")
+        elif count > 1:
+            self.add_system_message(f"{count} images generated! Pick your fave, they're all fire ✨")
+    
+    def cancel_image_generation(self):
+        if self.image_jobs:
+            for handle in self.image_jobs.values():
+                handle.cancel()
+            self.image_jobs = {}
+            self.image_progress.setVisible(False)
+            self.cancel_image_button.setVisible(False)
+            if not self.image_batch_results:
+                self.image_result_label.setText("Image generation cancelled. No worries fam 🤷")
 
     def display_generated_image(self, image_path):
         """Helper method to display generated image with proper scaling and download option"""
-        pixmap = QPixmap(image_path)
         self.current_image_path = image_path  # Store the path for download functionality
+        self.blob_store.set_pins("display", [image_path])
         
-        # Calculate available space while respecting window bounds
-        available_width = min(512, int(self.width() * 0.7))  # 70% of window width
-        available_height = min(512, int(self.height() * 0.6))  # 60% of window height
-        
-        scaled_pixmap = pixmap.scaled(
-            available_width,
-            available_height,
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation
-        )
-        
-        self.image_result_label.setPixmap(scaled_pixmap)
+        # Decoded off the GUI thread at display size, and kept in memory for repeat prompts
+        self.image_decoder.request(image_path, 512, 512,
+                                   lambda image: self.show_generated_pixmap(image_path, image))
         self.image_result_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.image_result_label.setStyleSheet("""
             QLabel {
@@ -1697,6 +4060,28 @@ class GenZChatbot(QMainWindow):
         # Show the download button
         self.download_button.setVisible(True)
 
+    def show_generated_pixmap(self, image_path, image):
+        # Another image may have been picked while this one was decoding
+        if image_path != self.current_image_path or image.isNull():
+            return
+        self.result_pixmaps.set_source(image)
+        self.image_result_label.setPixmap(self.scaled_result_pixmap())
+    
+    def scaled_result_pixmap(self):
+        # Calculate available space while respecting window bounds
+        available_width = min(512, int(self.width() * 0.7))  # 70% of window width
+        available_height = min(512, int(self.height() * 0.6))  # 60% of window height
+        return self.result_pixmaps.get(available_width, available_height)
+    
+    def rescale_generated_image(self):
+        """Fit the result image to the window, if one is being shown"""
+        pixmap = self.image_result_label.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return
+        scaled_pixmap = self.scaled_result_pixmap()
+        if scaled_pixmap is not None and scaled_pixmap.cacheKey() != pixmap.cacheKey():
+            self.image_result_label.setPixmap(scaled_pixmap)
+
     def download_image(self):
         """Save the currently displayed image to a user-selected location"""
         if not hasattr(self, 'current_image_path') or not self.current_image_path:
@@ -1743,214 +4128,314 @@ class GenZChatbot(QMainWindow):
             return
         
         # Prepare message content (text + optional image)
+        image = self.current_image
+        if image and not os.access(image, os.R_OK):
+            # Sending it would fail this request and every later one in the chat
+            QMessageBox.warning(self, "Image Missing",
+                               f"Can't read {os.path.basename(image)} anymore, so it was removed. Attach it again to send it.")
+            self.clear_image()
+            return
         message_content = {
             "text": message,
-            "images": [self.current_image] if self.current_image else []
+            "images": [image] if image else []
         }
         
-        # Add user message to chat
+        # A new message makes any reply still in flight obsolete
+        if self.settings["supersede_pending"]:
+            self.cancel_pending_replies()
+        
+        # Add user message to chat, and bring the bottom of the chat into view
         self.add_message_bubble(message_content, is_user=True)
+        self.transcript_view.anchor.follow()
         self.message_input.clear()
         
-        # Create and start worker thread
-        self.worker = MessageWorker(self.model, message, self.chat_history, self.current_image)
-        self.worker.response_ready.connect(self.handle_response)
-        self.worker.error_occurred.connect(self.handle_error)
-        self.worker.start()
+        # The image goes with this message only, whether or not the cache answers it
+        if image:
+            self.clear_image()
+        
+        contents, context_report = self.context_window.pack(self.conversation)
+        
+        # Identical requests are answered straight from the cache
+        cache_key = None
+        if self.settings["response_cache"]:
+            cache_key = ResponseCache.make_key(getattr(self.model, "model_name", ""),
+                                               GENERATION_CONFIG, contents)
+            cached_text = self.response_cache.get(cache_key)
+            self.update_cache_stats()
+            if cached_text is not None:
+                self.show_cached_response(cached_text, context_report)
+                return
+        
+        # Queue the request on the shared executor
+        worker = MessageWorker(self.model, contents, image,
+                               stream=self.settings["stream_responses"],
+                               context_report=context_report,
+                               cache=self.response_cache, cache_key=cache_key,
+                               image_payloads=self.image_payloads)
+        handle = worker.handle
+        worker.signals.chunk_ready.connect(lambda chunk: self.handle_chunk(handle, chunk))
+        worker.signals.response_ready.connect(lambda response: self.handle_response(handle, response))
+        worker.signals.error_occurred.connect(lambda error: self.handle_error(handle, error))
         
         # Add loading indicator
-        self.loading_indicator = LoadingIndicator()
-        self.chat_layout.addWidget(self.loading_indicator)
+        reply = PendingReply(handle)
+        reply.loading_row = self.transcript.append("loading", "")
+        self.pending_replies[handle.id] = reply
+        worker.signals.finished.connect(lambda: self.finish_reply(handle))
         
-        # Auto scroll to bottom
-        QApplication.processEvents()
-        scroll_bar = self.scroll_area.verticalScrollBar()
-        scroll_bar.setValue(scroll_bar.maximum())
+        self.executor.submit(worker)
+        self.stop_button.setVisible(True)
+    
+    def show_cached_response(self, text, context_report):
+        """Render a cached reply through the normal response path"""
+        handle = JobHandle("chat")
+        handle.status = "done"
+        self.pending_replies[handle.id] = PendingReply(handle)
+        
+        context_report.cached = True
+        context_report.reply_tokens = ContextWindowManager.estimate_tokens(text)
+        self.handle_response(handle, {"text": text, "images": [], "context": context_report})
+        self.finish_reply(handle)
+    
+    def update_cache_stats(self):
+        self.cache_stats_label.setText(self.response_cache.stats_text())
+    
+    def update_layout_stats(self):
+        relayouts, frames = self.layout_scheduler.take_stats()
+        self.layout_stats_label.setText(f"📐 {relayouts} relayouts/s in {frames} frames · "
+                                        f"{self.render_cache.stats_text()}")
+        self.layout_stats_label.setToolTip(self.post_processor.stats_text())
+    
+    def show_http_stats(self):
+        QMessageBox.information(self, "Connection Pools", self.http.stats_text())
+    
+    def clear_response_cache(self):
+        self.response_cache.clear()
+        self.update_cache_stats()
+        self.statusBar().showMessage("Reply cache cleared", 3000)
+    
+    def finish_reply(self, handle):
+        self.pending_replies.pop(handle.id, None)
+        self.stop_button.setVisible(bool(self.pending_replies))
+    
+    def cancel_pending_replies(self):
+        """Cancel every reply in flight and forget about its results"""
+        for reply in self.pending_replies.values():
+            reply.handle.cancel()
+            self.remove_partial_reply(reply)
+        self.pending_replies.clear()
+        self.stop_button.setVisible(False)
+    
+    def stop_generation(self):
+        if self.pending_replies:
+            self.cancel_pending_replies()
+            self.add_system_message("Reply stopped. Say less 🤐")
+    
+    def remove_loading_indicator(self, reply):
+        if reply.loading_row:
+            self.transcript.remove(reply.loading_row)
+            reply.loading_row = None
+    
+    def remove_partial_reply(self, reply):
+        """Take an unfinished reply off screen; it never made it into the history"""
+        self.remove_loading_indicator(reply)
+        self.layout_scheduler.cancel(reply)
+        if reply.row is not None:
+            self.transcript.remove(reply.row)
+            reply.row = None
+    
+    def handle_chunk(self, handle, chunk):
+        """Append a streamed chunk to the live bot bubble"""
+        reply = self.pending_replies.get(handle.id)
+        if reply is None or handle.cancelled:
+            return
+        reply.renderer.feed(chunk)
         
-        # Clear the image after sending
-        if self.current_image:
-            self.clear_image()
+        # Chunks arriving within one frame are shown together
+        self.layout_scheduler.schedule(reply, lambda: self.render_streamed_reply(reply))
+    
+    def render_streamed_reply(self, reply):
+        if reply.handle.cancelled or reply.handle.id not in self.pending_replies:
+            return
+        # Markdown is parsed once per line, but the bubble gets the whole HTML again each
+        # frame; long replies collapse, so only their first piece is laid out again
+        html = reply.renderer.html()
+        
+        if reply.row is None:
+            # First visible token: swap the loading indicator for a live bubble
+            self.remove_loading_indicator(reply)
+            reply.row = self.transcript.append("bot", html)
+        else:
+            self.transcript.set_text(reply.row, html)
     
-    def handle_response(self, response):
+    def handle_response(self, handle, response):
         """Handle the bot response with proper text formatting"""
+        # Discard abandoned replies before doing any rendering work
+        reply = self.pending_replies.get(handle.id)
+        if reply is None or handle.cancelled:
+            return
+        
+        # The final text replaces any streamed render still waiting for a frame
+        self.layout_scheduler.cancel(reply)
+        
         # Remove loading indicator
-        if hasattr(self, 'loading_indicator') and self.loading_indicator:
-            self.chat_layout.removeWidget(self.loading_indicator)
-            self.loading_indicator.deleteLater()
-            self.loading_indicator = None
+        self.remove_loading_indicator(reply)
+        
+        # Report how much of the context budget this request used
+        if response.get("context"):
+            self.statusBar().showMessage(response["context"].summary())
+        
+        rendered = self.render_reply(response["text"])
+        response["raw_text"] = response["text"]
+        response["markdown"] = rendered.markdown
+        response["text"] = rendered.html
+        
+        if reply.row is not None:
+            # The reply was streamed into a live bubble, just finalize it
+            row = reply.row
+            row.source = rendered.markdown
+            self.transcript.set_text(row, rendered.html, rendered.heights)
+            self.add_to_history(response, is_user=False)
+        else:
+            # Add bot message to chat
+            row = self.add_message_bubble(response, is_user=False)
+            row.measured = rendered.heights
+        self.request_highlighting(row, self.conversation.turns[-1], rendered)
+    
+    def render_reply(self, raw_text, markdown=None):
+        """RenderedReply for one bubble; a reply rendered before skips formatting and rendering
+        
+        `markdown` is the post-processed text when it is already known, e.g. for a
+        restored reply, so it is shown as it was before.
+        """
+        key = RenderCache.make_key(raw_text)
+        rendered = self.render_cache.get(key)
+        if rendered is not None and markdown in (None, rendered.markdown):
+            return rendered
         
         # Format the response to make it more Gen Z friendly while preserving markdown
-        formatted_response = self.format_genz_response(response["text"])
+        if markdown is None:
+            markdown = self.format_genz_response(raw_text)
         
         # Convert markdown to HTML for proper display in QTextEdit
-        formatted_html = self.markdown_to_html(formatted_response)
-        response["text"] = formatted_html
-        
-        # Add bot message to chat
-        self.add_message_bubble(response, is_user=False)
+        renderer = MarkdownRenderer(self.code_highlighter.cached)
+        renderer.feed(markdown)
+        renderer.finish()
+        rendered = RenderedReply(key, markdown, renderer.html(), renderer.unhighlighted)
+        self.render_cache.put(key, rendered)
+        return rendered
+    
+    def request_highlighting(self, row, turn, rendered):
+        # Code shows plain right away; highlighted versions are swapped in when ready
+        for language, code in rendered.pending:
+            self.code_highlighter.request(language, code,
+                                          lambda html: self.rehighlight_reply(row, turn, rendered))
+    
+    def rehighlight_reply(self, row, turn, rendered):
+        # Several blocks finishing in one frame cost a single re-render
+        self.layout_scheduler.schedule(("highlight", row), lambda: self.apply_highlighting(row, turn, rendered))
+    
+    def apply_highlighting(self, row, turn, rendered):
+        renderer = MarkdownRenderer(self.code_highlighter.cached)
+        renderer.feed(rendered.markdown)
+        renderer.finish()
+        rendered.html = renderer.html()
+        rendered.pending = renderer.unhighlighted
+        rendered.heights = {}
+        self.transcript.set_text(row, rendered.html, rendered.heights)
+        # Keep the history and the cache in step, so a saved session has the highlighted markup
+        turn.html = rendered.html
+        self.render_cache.put(rendered.key, rendered)
 
     def format_genz_response(self, text):
         """Add Gen Z style formatting to the response while preserving markdown"""
-        import random
-        import re
-        
-        # If the text is highly technical, don't apply GenZ formatting
-        if len(text) > 500 or any(code_indicator in text for code_indicator in ["```", "def ", "class ", "<html>"]):
-            return text
-        
-        # Store code blocks and markdown elements to protect them from modification
-        protected_elements = []
-        
-        # Function to store protected elements and replace with placeholders
-        def protect_element(match):
-            protected_elements.append(match.group(0))
-            return f"__PROTECTED_{len(protected_elements)-1}__"
-        
-        # Protect code blocks
-        code_block_pattern = r"```[\s\S]*?```"
-        text = re.sub(code_block_pattern, protect_element, text)
-        
-        # Protect inline code
-        inline_code_pattern = r"`[^`]*`"
-        text = re.sub(inline_code_pattern, protect_element, text)
-        
-        # Protect bold and italic text
-        bold_pattern = r"\*\*[^*]*\*\*"
-        text = re.sub(bold_pattern, protect_element, text)
-        italic_pattern = r"\*[^*]*\*"
-        text = re.sub(italic_pattern, protect_element, text)
-        
-        # Now add GenZ slang to the protected text
-        gen_z_expressions = [
-            " no cap", " fr", " tbh", " lowkey", " highkey", " bet", " vibes", " bruh", 
-            " slay", " iconic", " tho", " ngl", " hit different", " is giving", " sheesh"
-        ]
-        
-        # Replace some periods with Gen Z expressions (but not too many)
-        sentences = text.split('. ')
-        if len(sentences) > 3:
-            # Pick 1-2 sentences to modify
-            num_to_modify = min(2, len(sentences) // 3)
-            indices_to_modify = random.sample(range(len(sentences)), num_to_modify)
-            
-            for i in indices_to_modify:
-                if i < len(sentences) - 1:  # Don't modify the last sentence
-                    if random.random() < 0.7:  # 70% chance to add an expression
-                        expression = random.choice(gen_z_expressions)
-                        sentences[i] = sentences[i] + expression
-            
-            text = '. '.join(sentences)
-        
-        # Define emojis
-        EMOJI_LIST = ["😂", "💯", "👀", "✨", "🔥", "💅", "🙌", "👑", "🤩", "😭", "💀", "🤌", "🤷‍♀️", "🥺", "👉👈"]
-        
-        # Randomly add 1-2 emojis
-        emoji_count = random.randint(1, 2)
-        for _ in range(emoji_count):
-            random_emoji = random.choice(EMOJI_LIST)
-            # Insert emoji at a random position, preferring the end of sentences
-            if '. ' in text:
-                parts = text.split('. ')
-                part_to_modify = random.randint(0, len(parts) - 1)
-                parts[part_to_modify] = parts[part_to_modify] + f" {random_emoji}"
-                text = '. '.join(parts)
-            else:
-                # Just add to the end if no periods
-                text = text + f" {random_emoji}"
-        
-        # Restore protected elements
-        for i, element in enumerate(protected_elements):
-            text = text.replace(f"__PROTECTED_{i}__", element)
-        
-        return text
+        return self.post_processor.process(text)
 
     def markdown_to_html(self, markdown_text):
         """Convert markdown to HTML for proper display in QTextEdit"""
-        import re
-        
-        # Function to process code blocks
-        def replace_code_block(match):
-            code = match.group(1)
-            # Add syntax highlighting classes if needed
-            return f'<pre style="background-color: #1E1E1E; padding: 10px; border-radius: 5px; color: #D4D4D4; font-family: monospace;">{code}</pre>'
-        
-        # Replace code blocks with HTML
-        markdown_text = re.sub(r'```([\s\S]*?)```', replace_code_block, markdown_text)
-        
-        # Replace inline code with HTML
-        markdown_text = re.sub(r'`([^`]+)`', r'<code style="background-color: #1E1E1E; padding: 2px 4px; border-radius: 3px; color: #D4D4D4; font-family: monospace;">\1</code>', markdown_text)
-        
-        # Replace bold text
-        markdown_text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', markdown_text)
-        
-        # Replace italic text
-        markdown_text = re.sub(r'\*(.*?)\*', r'<em>\1</em>', markdown_text)
-        
-        # Replace headers (h1, h2, h3)
-        markdown_text = re.sub(r'^# (.*?)$', r'<h1>\1</h1>', markdown_text, flags=re.MULTILINE)
-        markdown_text = re.sub(r'^## (.*?)$', r'<h2>\1</h2>', markdown_text, flags=re.MULTILINE)
-        markdown_text = re.sub(r'^### (.*?)$', r'<h3>\1</h3>', markdown_text, flags=re.MULTILINE)
-        
-        # Replace bullet points
-        markdown_text = re.sub(r'^\* (.*?)$', r'<ul><li>\1</li></ul>', markdown_text, flags=re.MULTILINE)
-        # Clean up multiple consecutive ul tags
-        markdown_text = re.sub(r'</ul>\s*<ul>', '', markdown_text)
-        
-        # Replace numbered lists
-        markdown_text = re.sub(r'^(\d+)\. (.*?)$', r'<ol start="\1"><li>\2</li></ol>', markdown_text, flags=re.MULTILINE)
-        # Clean up multiple consecutive ol tags
-        markdown_text = re.sub(r'</ol>\s*<ol start="\d+">', '', markdown_text)
-        
-        # Replace links
-        markdown_text = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2" style="color: #9F6EFF; text-decoration: underline;">\1</a>', markdown_text)
-        
-        # Replace paragraphs (two newlines)
-        markdown_text = re.sub(r'\n\s*\n', r'<br><br>', markdown_text)
-        
-        # Replace single newlines with <br>
-        markdown_text = re.sub(r'\n', r'<br>', markdown_text)
-        
-        return markdown_text
+        return MarkdownRenderer.render(markdown_text, self.code_highlighter.cached)
     
-    def handle_error(self, error_message):
-        # Remove loading indicator
-        if hasattr(self, 'loading_indicator') and self.loading_indicator:
-            self.chat_layout.removeWidget(self.loading_indicator)
-            self.loading_indicator.deleteLater()
-            self.loading_indicator = None
+    def handle_error(self, handle, error_message):
+        reply = self.pending_replies.get(handle.id)
+        if reply is None or handle.cancelled:
+            return
+        
+        # A half-streamed reply isn't in the history, so it leaves the screen too
+        self.remove_partial_reply(reply)
             
         # Add error message
         self.add_system_message(f"Error: {error_message}")
     
     def clear_chat(self):
-        # Clear layout with proper resource cleanup
-        while self.chat_layout.count():
-            item = self.chat_layout.takeAt(0)
-            widget = item.widget()
-            if widget:
-                widget.hide()  # Hide before deletion to prevent visual artifacts
-                widget.deleteLater()
-            elif item.layout():
-                # Recursively clear nested layouts if any
-                self.clear_layout(item.layout())
+        # Nothing in flight belongs to the new conversation
+        self.cancel_pending_replies()
         
         # Clear chat history
-        self.chat_history = []
+        self.transcript.clear()
+        self.conversation.clear()
+        self.context_window.clear()
+        self.blob_store.set_pins("conversation", [])
         
         # Add welcome message
         self.add_system_message("Chat cleared! Fresh vibes only from here! ✨")
 
-    def clear_layout(self, layout):
-        """Helper method to recursively clear nested layouts"""
-        if layout is not None:
-            while layout.count():
-                item = layout.takeAt(0)
-                widget = item.widget()
-                if widget:
-                    widget.hide()
-                    widget.deleteLater()
-                elif item.layout():
-                    self.clear_layout(item.layout())
+    def save_session(self):
+        """Write the conversation to SESSION_FILE so the next start can pick it up"""
+        # Replies keep the text they were rendered from, not the HTML, so a newer
+        # renderer shows them with its own markup
+        turns = [{"role": turn.role, "text": turn.text, "markdown": turn.markdown, "image": turn.image}
+                 for turn in self.conversation]
+        try:
+            with open(SESSION_FILE, 'w') as f:
+                json.dump(turns, f)
+        except OSError as e:
+            print(f"Could not save session: {e}")
+    
+    def restore_session(self):
+        if not os.path.exists(SESSION_FILE):
+            return
+        try:
+            with open(SESSION_FILE, 'r') as f:
+                turns = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not restore session: {e}")
+            return
+        
+        messages = []
+        replies = []  # (position, RenderedReply) of each bot message
+        for turn in turns:
+            # Images may have been evicted from the store since
+            image = turn.get("image")
+            images = [image] if image and os.path.exists(image) else []
+            if turn["role"] == "user":
+                messages.append(({"text": turn["text"], "images": images}, True))
+            else:
+                rendered = self.render_reply(turn["text"], turn.get("markdown") or turn["text"])
+                replies.append((len(messages), rendered))
+                messages.append(({"text": rendered.html, "raw_text": turn["text"],
+                                  "markdown": rendered.markdown, "images": images}, False))
+        rows = self.add_message_bubbles(messages)
+        history = self.conversation.turns[-len(messages):] if messages else []
+        for position, rendered in replies:
+            row = rows[position]
+            row.source = rendered.markdown
+            row.measured = rendered.heights
+            # Highlight code only in replies that are scrolled to, not the whole session
+            if rendered.pending:
+                row.on_shown = (lambda row=row, turn=history[position], rendered=rendered:
+                                self.request_highlighting(row, turn, rendered))
+        if messages:
+            self.add_system_message(f"Picked up where we left off ({len(messages)} messages) 🔁")
+    
+    def closeEvent(self, event):
+        """Stop in-flight requests; closing waits a few seconds at most for blocked calls"""
+        self.cancel_pending_replies()
+        self.executor.shutdown()
+        self.http.close()
+        self.blob_store.flush()
+        if self.settings["restore_session"]:
+            self.save_session()
+        super().closeEvent(event)
 
 def main():
     app = QApplication(sys.argv)
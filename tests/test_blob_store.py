@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import BlobStore  # noqa: E402
+
+
+def test_identical_bytes_are_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1000)
+    first = store.put_bytes(b"abc", "png")
+    second = store.put_bytes(b"abc", "png")
+    assert first == second
+    assert store.total_bytes == 3
+    assert sorted(os.listdir(tmp_path)) == sorted([BlobStore.INDEX_FILE, os.path.basename(first)])
+
+
+def test_evict_drops_least_recently_used(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=20)
+    a = store.put_bytes(b"a" * 8, "png")
+    b = store.put_bytes(b"b" * 8, "png")
+    store.get(store.digest_of(a))  # a is now the most recent
+    c = store.put_bytes(b"c" * 8, "png")
+    assert not os.path.exists(b)
+    assert os.path.exists(a) and os.path.exists(c)
+    assert store.total_bytes == 16
+
+
+def test_evict_skips_pinned_and_newest(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=10)
+    a = store.put_bytes(b"a" * 8, "png")
+    store.set_pins("chat", [a])
+    b = store.put_bytes(b"b" * 8, "png")
+    # Over the cap, but one blob is pinned and the other was just stored
+    assert os.path.exists(a) and os.path.exists(b)
+    store.set_pins("chat", [])
+    store.put_bytes(b"c" * 8, "png")
+    assert not os.path.exists(a) and not os.path.exists(b)
+
+
+def test_eviction_drops_aliases(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=10)
+    a = store.put_bytes(b"a" * 8, "png")
+    store.alias("prompt", store.digest_of(a))
+    assert store.resolve("prompt") == a
+    store.put_bytes(b"b" * 8, "png")
+    assert store.resolve("prompt") is None
+
+
+def test_index_survives_reload(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=100)
+    a = store.put_bytes(b"a" * 8, "png")
+    store.alias("prompt", store.digest_of(a))
+    reloaded = BlobStore(str(tmp_path), max_bytes=100)
+    assert reloaded.resolve("prompt") == a
+    assert reloaded.total_bytes == 8
+
+
+def test_sweep_reconciles_directory(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=100)
+    kept = store.put_bytes(b"kept", "png")
+    lost = store.put_bytes(b"lost", "png")
+    os.remove(lost)
+    (tmp_path / "generated_1700000000.png").write_bytes(b"old")
+    stale = tmp_path / "stale.part"
+    stale.write_bytes(b"half")
+    os.utime(stale, (0, 0))
+    fresh = tmp_path / "fresh.part"
+    fresh.write_bytes(b"half")
+    
+    assert store.sweep() == 2
+    assert store.digest_of(lost) is None
+    assert store.total_bytes == 4
+    assert sorted(os.listdir(tmp_path)) == sorted([BlobStore.INDEX_FILE, os.path.basename(kept), "fresh.part"])
+
+
+def test_sweep_enforces_a_lowered_cap(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=100)
+    a = store.put_bytes(b"a" * 8, "png")
+    b = store.put_bytes(b"b" * 8, "png")
+    store.max_bytes = 10
+    store.sweep()
+    assert not os.path.exists(a) and os.path.exists(b)
@@ -0,0 +1,115 @@
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import ContextWindowManager, Conversation  # noqa: E402
+
+
+def build(budget, *texts):
+    """A conversation alternating user and model turns, tracked by a manager"""
+    conversation = Conversation()
+    manager = ContextWindowManager(budget)
+    for index, text in enumerate(texts):
+        conversation.append("user" if index % 2 == 0 else "model", text)
+        manager.append(text)
+    return conversation, manager
+
+
+def test_everything_fits():
+    conversation, manager = build(1000, "hi", "hello", "how are you")
+    contents, report = manager.pack(conversation)
+    assert contents == conversation.contents
+    assert report.sent_messages == 3
+    assert report.dropped_messages == 0
+    assert report.prompt_tokens == manager.cumulative[-1]
+
+
+def test_budget_exactly_met_drops_nothing():
+    conversation, manager = build(6, "a" * 8, "b" * 8, "c" * 8)  # 2 tokens each
+    contents, report = manager.pack(conversation)
+    assert report.dropped_messages == 0
+    assert len(contents) == 3
+
+
+def test_over_budget_drops_oldest_and_opens_with_user():
+    texts = ["question %d " % i + "x" * 36 for i in range(10)]  # 12 tokens each
+    conversation, manager = build(60, *texts)
+    contents, report = manager.pack(conversation)
+    assert report.dropped_messages > 0
+    assert report.dropped_messages % 2 == 0  # Cut lands on a user turn
+    assert report.sent_messages == 10 - report.dropped_messages
+    assert contents[0]["role"] == "user"
+    assert contents[0]["parts"][0].startswith("[Earlier conversation trimmed:")
+    assert contents[-1] is conversation.contents[-1]
+    assert report.prompt_tokens <= 60
+
+
+def test_newest_message_is_sent_even_over_budget():
+    conversation, manager = build(5, "short", "reply", "z" * 400)
+    contents, report = manager.pack(conversation)
+    assert report.sent_messages == 1
+    assert contents[-1]["parts"][-1] == "z" * 400
+
+
+def test_preamble_merges_into_first_user_turn():
+    conversation, manager = build(1000, "hi", "hello", "again")
+    manager.pin("Be brief.")
+    contents, _ = manager.pack(conversation)
+    assert [content["role"] for content in contents] == ["user", "model", "user"]
+    assert contents[0]["parts"] == ["Be brief.", "hi"]
+    # The conversation's own payload is left alone
+    assert conversation.contents[0]["parts"] == ["hi"]
+
+
+def test_preamble_alone_for_an_empty_conversation():
+    conversation, manager = build(1000)
+    manager.pin("Be brief.")
+    contents, report = manager.pack(conversation)
+    assert contents == [{"role": "user", "parts": ["Be brief."]}]
+    assert report.sent_messages == 0
+
+
+def test_pinned_tokens_come_out_of_the_budget():
+    conversation, manager = build(20, "a" * 40, "b" * 40, "c" * 40)  # 10 tokens each
+    manager.pin("p" * 40)
+    contents, report = manager.pack(conversation)
+    assert report.dropped_messages == 2
+    assert contents[0]["parts"][0] == "p" * 40
+    assert contents[0]["parts"][-1] == "c" * 40
+
+
+def test_collapse_note_is_deterministic_and_bounded():
+    texts = [f"topic number {i} with some words" for i in range(100)]
+    conversation, manager = build(400, *texts)
+    first, _ = manager.pack(conversation)
+    second, _ = manager.pack(conversation)
+    assert first == second
+    note = first[0]["parts"][0]
+    assert "Recent topics:" in note
+    assert manager.estimate_tokens(note) <= 400 // 4
+
+
+def test_conversation_keeps_contents_in_step_with_turns():
+    conversation = Conversation()
+    turn = conversation.append("user", "hi")
+    conversation.append("model", "hello")
+    assert conversation.contents[0] is turn.content
+    assert len(conversation.contents) == len(conversation) == 2
+    conversation.clear()
+    assert conversation.contents == [] and len(conversation) == 0
+
+
+def test_unanswered_user_turns_are_merged():
+    conversation, manager = build(1000, "hi", "hello")
+    for text in ("cancelled", "failed", "answer this"):
+        conversation.append("user", text)
+        manager.append(text)
+    manager.pin("Be brief.")
+    contents, report = manager.pack(conversation)
+    assert [content["role"] for content in contents] == ["user", "model", "user"]
+    assert contents[-1]["parts"] == ["cancelled", "failed", "answer this"]
+    assert report.sent_messages == 5
+    # Merging builds new entries, the conversation's payload is unchanged
+    assert conversation.contents[2]["parts"] == ["cancelled"]
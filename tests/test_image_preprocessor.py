@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from main import ImagePreprocessor, ImageUploadReport  # noqa: E402
+
+
+def encode(image, format, **params):
+    output = io.BytesIO()
+    image.save(output, format, **params)
+    return output.getvalue()
+
+
+def test_original_is_sent_when_reencoding_grows_it():
+    image = Image.new("RGB", (600, 400), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, 400, 12):
+        draw.text((5, y), f"def f(x): return x * {y}", fill="black")
+    data = encode(image.convert("P", palette=Image.Palette.ADAPTIVE, colors=4), "PNG", optimize=True)
+    assert ImagePreprocessor().process(data, "image/png") == (data, "image/png")
+
+
+def test_large_images_are_downscaled():
+    data = encode(Image.new("RGB", (4000, 3000), "white"), "PNG")
+    sent, mime_type = ImagePreprocessor(max_edge=1600).process(data, "image/png")
+    assert mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(sent)).size == (1600, 1200)
+
+
+def test_orientation_is_baked_in():
+    image = Image.new("RGB", (40, 20), "red")
+    exif = image.getexif()
+    exif[0x0112] = 6  # Rotated 90 degrees
+    sent, _ = ImagePreprocessor().process(encode(image, "JPEG", exif=exif, quality=20), "image/jpeg")
+    assert Image.open(io.BytesIO(sent)).size == (20, 40)
+
+
+def test_undecodable_bytes_pass_through():
+    assert ImagePreprocessor().process(b"not an image", "image/heic") == (b"not an image", "image/heic")
+
+
+def test_report_states_growth():
+    assert ImageUploadReport(100_000, 200_000, 5).summary().endswith("more upload")
+    assert ImageUploadReport(200_000, 100_000, 5).summary().endswith("less upload")
+    assert ImageUploadReport(100, 100, 5).summary().endswith("sent as is")
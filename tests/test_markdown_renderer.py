@@ -0,0 +1,135 @@
+from html import escape
+
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import MarkdownRenderer  # noqa: E402
+
+SAMPLE = """# Title
+Some **bold** and *italic* text with `code` and a [link](https://example.com).
+A second line.
+
+A new paragraph.
+* one
+* two
+
+1. first
+2. second
+
+```python
+def f(x):
+    return x < 1
+```
+Done & dusted.
+"""
+
+
+def long_reply(paragraphs=40):
+    lines = []
+    for index in range(paragraphs):
+        lines.append(f"Paragraph {index} " + "words " * 20)
+        lines.append("")
+        if index % 10 == 3:
+            lines += ["* a", "* b", "", "```", *[f"line {n}" for n in range(30)], "```"]
+    return "\n".join(lines)
+
+
+def spans(language, code):
+    # Every other pair of lines shares one span, like a multi-line string would
+    lines = code.split("\n")
+    out = []
+    for index in range(0, len(lines), 2):
+        out.append(f'<span style="color: #f00">{escape(chr(10).join(lines[index:index + 2]), quote=False)}</span>')
+    return "\n".join(out)
+
+
+def rejoin(pieces):
+    """Undo split(): a code block cut drops the newline it was cut at"""
+    html = pieces[0]
+    for piece in pieces[1:]:
+        if piece.startswith(MarkdownRenderer.CODE_CONTINUED):
+            assert html.endswith("</pre>")
+            html = html[:-len("</pre>")] + "\n"
+            piece = piece[len(MarkdownRenderer.CODE_CONTINUED):]
+            piece = piece[piece.index(">") + 1:]
+        html += piece
+    return html
+
+
+def test_render_basics():
+    html = MarkdownRenderer.render(SAMPLE)
+    assert "<h1>Title</h1>" in html
+    assert "<strong>bold</strong>" in html and "<em>italic</em>" in html
+    assert '<a href="https://example.com"' in html
+    assert "<ul><li>one</li><li>two</li></ul>" in html
+    assert '<ol start="1"><li>first</li><li>second</li></ol>' in html
+    assert "return x &lt; 1" in html
+    assert "Done &amp; dusted." in html
+
+
+def test_streamed_output_matches_one_shot():
+    expected = MarkdownRenderer.render(SAMPLE)
+    for size in (1, 3, 7, 64):
+        renderer = MarkdownRenderer()
+        for start in range(0, len(SAMPLE), size):
+            renderer.feed(SAMPLE[start:start + size])
+            renderer.html()  # Provisional renders must not disturb the state
+        renderer.finish()
+        assert renderer.html() == expected
+
+
+def test_html_is_repeatable_mid_stream():
+    renderer = MarkdownRenderer()
+    renderer.feed("* item\n```\nopen code")
+    first = renderer.html()
+    assert first == renderer.html()
+    assert first.endswith("open code</pre>")
+
+
+def test_highlighted_code_replaces_plain_lines():
+    highlighted = lambda language, code: f'<span class="{language}">{escape(code, quote=False)}</span>'
+    html = MarkdownRenderer.render("```python\nx = 1\n```", highlighted)
+    assert '<span class="python">x = 1</span></pre>' in html
+
+
+def test_unhighlighted_blocks_are_recorded():
+    renderer = MarkdownRenderer(lambda language, code: None)
+    renderer.feed("```js\nlet a\n```\n")
+    renderer.finish()
+    assert renderer.unhighlighted == [("js", "let a")]
+
+
+def test_split_short_html_is_one_piece():
+    html = MarkdownRenderer.render(SAMPLE)
+    assert MarkdownRenderer.split(html, 10_000) == [html]
+
+
+def test_split_pieces_rejoin_to_the_original():
+    html = MarkdownRenderer.render(long_reply())
+    pieces = MarkdownRenderer.split(html, 500)
+    assert len(pieces) > 5
+    assert rejoin(pieces) == html
+    for piece in pieces:
+        # Lists are never cut and code pieces are closed
+        assert piece.count("<ul>") == piece.count("</ul>")
+        assert piece.count("<pre") == piece.count("</pre>")
+
+
+def test_split_cuts_before_line_breaks():
+    html = MarkdownRenderer.render(long_reply())
+    pieces = MarkdownRenderer.split(html, 500)
+    assert not any(piece.endswith("<br>") for piece in pieces)
+    assert any(piece.startswith("<br><br>") for piece in pieces)
+
+
+def test_split_keeps_highlighting_spans_whole():
+    html = MarkdownRenderer.render(long_reply(), spans)
+    pieces = MarkdownRenderer.split(html, 200)
+    assert rejoin(pieces) == html
+    continued = [piece for piece in pieces if piece.startswith(MarkdownRenderer.CODE_CONTINUED)]
+    assert continued
+    for piece in pieces:
+        assert piece.count("<span") == piece.count("</span>")
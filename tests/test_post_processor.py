@@ -0,0 +1,59 @@
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import ResponsePostProcessor  # noqa: E402
+
+REPLY = "First point here. Second one. Third thing. Fourth idea. Fifth and last"
+
+
+def test_same_seed_same_output():
+    assert ResponsePostProcessor(seed=7).process(REPLY) == ResponsePostProcessor(seed=7).process(REPLY)
+
+
+def test_reseed_reproduces_output():
+    processor = ResponsePostProcessor(seed=3)
+    first = processor.process(REPLY)
+    processor.reseed(3)
+    assert processor.process(REPLY) == first
+
+
+def test_adds_emoji_without_losing_text():
+    processed = ResponsePostProcessor(seed=1).process(REPLY)
+    assert processed != REPLY
+    assert any(emoji in processed for emoji in ResponsePostProcessor.EMOJIS)
+    for sentence in REPLY.split(". "):
+        assert sentence in processed
+
+
+def test_markdown_spans_are_left_untouched():
+    text = "Use `a. b. c` here. Then **bold. text** too. And *it. al* also. One more. End"
+    for seed in range(20):
+        processed = ResponsePostProcessor(seed=seed).process(text)
+        for span in ("`a. b. c`", "**bold. text**", "*it. al*"):
+            assert span in processed
+        assert "\x00" not in processed
+
+
+def test_technical_and_long_replies_pass_through():
+    processor = ResponsePostProcessor(seed=0, max_length=50)
+    code = "Here:\n```python\nprint(1)\n```"
+    assert processor.process(code) == code
+    assert processor.process(REPLY) == REPLY
+    assert processor.calls == 0
+
+
+def test_no_length_limit():
+    text = "Sentence. " * 100
+    assert ResponsePostProcessor(seed=0, max_length=None).process(text) != text
+
+
+def test_stage_timings_are_recorded():
+    processor = ResponsePostProcessor(seed=0)
+    assert processor.stats_text() == "Post-processing: no replies yet"
+    processor.process(REPLY)
+    assert processor.calls == 1
+    assert all(processor.timings[stage] >= 0 for stage in ResponsePostProcessor.STAGES)
+    assert processor.stats_text().startswith("Post-processing (1 replies, avg): protect")
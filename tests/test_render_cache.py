@@ -0,0 +1,38 @@
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import RenderCache, RenderedReply  # noqa: E402
+
+
+def test_measured_heights_reach_the_cached_entry():
+    cache = RenderCache()
+    key = RenderCache.make_key("raw")
+    row_copy = cache.put(key, RenderedReply(key, "md", "<p>md</p>", []))
+    row_copy.heights[600] = 57  # What the delegate does when it measures
+    assert cache.get(key).heights == {600: 57}
+
+
+def test_highlighting_one_copy_leaves_the_others():
+    cache = RenderCache()
+    key = RenderCache.make_key("raw")
+    cache.put(key, RenderedReply(key, "md", "plain", [("py", "x")]))
+    first, second = cache.get(key), cache.get(key)
+    first.html, first.pending, first.heights = "highlighted", [], {}
+    first.heights[600] = 60
+    assert (second.html, second.pending) == ("plain", [("py", "x")])
+    assert second.heights == {}
+    cache.put(key, first)
+    assert cache.get(key).heights == {600: 60}
+
+
+def test_lru_bound_and_stats():
+    cache = RenderCache(max_entries=1)
+    for text in ("a", "b"):
+        key = RenderCache.make_key(text)
+        cache.put(key, RenderedReply(key, text, text, []))
+    assert cache.get(RenderCache.make_key("a")) is None
+    assert cache.get(RenderCache.make_key("b")).html == "b"
+    assert cache.stats_text() == "render cache 1/2 hits (50%)"
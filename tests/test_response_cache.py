@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+
+from main import ImagePart, ResponseCache  # noqa: E402
+
+CONTENTS = [{"role": "user", "parts": ["hello  there"]}]
+
+
+def test_key_ignores_outer_whitespace_and_tracks_config():
+    key = ResponseCache.make_key("model", {"temperature": 0.9}, CONTENTS)
+    padded = [{"role": "user", "parts": ["\n hello  there \r\n"]}]
+    assert ResponseCache.make_key("model", {"temperature": 0.9}, padded) == key
+    assert ResponseCache.make_key("model", {"temperature": 0.1}, CONTENTS) != key
+    assert ResponseCache.make_key("other", {"temperature": 0.9}, CONTENTS) != key
+
+
+def test_key_keeps_indentation_and_line_breaks():
+    def key(code):
+        return ResponseCache.make_key("model", {}, [{"role": "user", "parts": [code]}])
+    assert key("if x:\n    y()\nz()") != key("if x:\n    y()\n    z()")
+    assert key("a()\nb()") != key("a() b()")
+    assert key("a()\r\nb()") == key("a()\nb()")
+
+
+def test_key_uses_inline_data_digest():
+    def contents(data):
+        return [{"role": "user", "parts": [{"inline_data": {"mime_type": "image/png", "data": data}}]}]
+    key = ResponseCache.make_key("model", {}, contents("AAAA"))
+    assert ResponseCache.make_key("model", {}, contents("AAAA")) == key
+    assert ResponseCache.make_key("model", {}, contents("BBBB")) != key
+
+
+def test_key_for_missing_image_file(tmp_path):
+    part = ImagePart(str(tmp_path / "gone.png"))
+    contents = [{"role": "user", "parts": ["look", part]}]
+    assert ResponseCache.make_key("model", {}, contents)
+
+
+def test_memory_hit_and_miss_counts(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("k") is None
+    cache.put("k", "reply")
+    assert cache.get("k") == "reply"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    ResponseCache(str(tmp_path)).put("k", "reply")
+    cache = ResponseCache(str(tmp_path))
+    assert "k" not in cache.memory
+    assert cache.get("k") == "reply"
+    assert "k" in cache.memory  # Promoted
+
+
+def test_memory_tier_is_lru_bounded(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.get("b") == "2"  # Still on disk
+
+
+def test_expired_entries_are_misses_and_removed(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=-1)
+    cache.put("k", "reply")
+    assert cache.get("k") is None
+    assert not os.path.exists(cache.path_for("k"))
+
+
+def test_invalidate_and_clear(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+    assert not os.path.exists(str(tmp_path / "b.json"))
+
+
+def test_sweep_prunes_expired_files(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=3600)
+    cache.put("old", "1")
+    cache.put("new", "2")
+    os.utime(cache.path_for("old"), (0, 0))
+    stale = tmp_path / "gone.json.tmp"
+    stale.write_text("{")
+    os.utime(stale, (0, 0))
+    assert cache.sweep() == 2
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+    assert ResponseCache(str(tmp_path)).get("new") == "2"
+
+
+def test_sweep_without_directory(tmp_path):
+    assert ResponseCache(str(tmp_path / "missing")).sweep() == 0
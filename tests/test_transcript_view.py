@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+# main needs the app's GUI and Gemini dependencies
+pytest.importorskip("PyQt6.QtWidgets")
+pytest.importorskip("google.generativeai")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtCore import QPoint, Qt  # noqa: E402
+from PyQt6.QtTest import QTest  # noqa: E402
+from PyQt6.QtWidgets import QApplication  # noqa: E402
+
+from main import LayoutScheduler, TranscriptModel, TranscriptView  # noqa: E402
+
+
+@pytest.fixture
+def view():
+    app = QApplication.instance() or QApplication([])
+    scheduler = LayoutScheduler()
+    model = TranscriptModel(scheduler)
+    view = TranscriptView(model)
+    view.resize(700, 500)
+    view.show()
+    yield view
+    view.close()
+    app.processEvents()
+
+
+def settle(view):
+    view.model().scheduler.flush()
+    view.executeDelayedItemsLayout()
+    QApplication.processEvents()
+
+
+def button_center(view, row, rect_for):
+    index = view.model().index_of(row)
+    rect = view.visualRect(index)
+    _, bubble = view.delegate.row_layout(row, rect.width())
+    return rect_for(bubble).translated(rect.topLeft()).center()
+
+
+def hover_and_click(view, point):
+    viewport = view.viewport()
+    QTest.mouseMove(viewport, QPoint(point.x(), point.y() - 40))  # Over the text first
+    QApplication.processEvents()
+    QTest.mouseClick(viewport, Qt.MouseButton.LeftButton, pos=point)
+    QApplication.processEvents()
+
+
+def test_copy_works_while_hover_editor_is_open(view):
+    row = view.model().append("bot", "Hello <strong>there</strong>")
+    settle(view)
+    copied = []
+    view.delegate.copy_requested.connect(copied.append)
+    
+    hover_and_click(view, button_center(view, row, view.delegate.copy_rect))
+    assert view.delegate.editing_row is row  # The editor was open for the click
+    assert copied == [row]
+
+
+def test_show_more_works_while_hover_editor_is_open(view):
+    text = "<br>".join("line %d " % n + "words " * 30 for n in range(400))
+    row = view.model().append("bot", text)
+    settle(view)
+    assert len(view.delegate.pieces_for(row)) > 1
+    expanded = []
+    view.delegate.expand_requested.disconnect()
+    view.delegate.expand_requested.connect(expanded.append)
+    
+    # The button sits at the bottom of the collapsed reply
+    view.verticalScrollBar().setValue(view.verticalScrollBar().maximum())
+    settle(view)
+    hover_and_click(view, button_center(view, row, view.delegate.expand_rect))
+    assert view.delegate.editing_row is row
+    assert expanded == [row]
+
+
+def test_clicks_on_text_are_left_to_the_view(view):
+    row = view.model().append("bot", "Hello")
+    settle(view)
+    copied = []
+    view.delegate.copy_requested.connect(copied.append)
+    rect = view.visualRect(view.model().index_of(row))
+    QTest.mouseClick(view.viewport(), Qt.MouseButton.LeftButton, pos=rect.topLeft() + QPoint(40, 30))
+    assert copied == []